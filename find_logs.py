@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+from podcomm.logstore import find_log_segments, COMPRESSED_SUFFIX
+from podcomm.definitions import DATA_PATH, LOG_INDEX_FILE
+from datetime import datetime
+import argparse
+import gzip
+import sys
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find rotated log segments by pod id and time range")
+    parser.add_argument("-l", "--log", type=str, help="Log name, e.g. omnipy or packet")
+    parser.add_argument("-p", "--pod", type=str, help="Pod id as lot-tid")
+    parser.add_argument("-s", "--start", type=parse_time, help="Start of the time range, ISO format")
+    parser.add_argument("-e", "--end", type=parse_time, help="End of the time range, ISO format")
+    parser.add_argument("-d", "--dump", action="store_true", help="Write the contents of the segments to stdout")
+    parser.add_argument("-i", "--index", type=str, default=DATA_PATH + LOG_INDEX_FILE, help="Path to the log index")
+    args = parser.parse_args()
+
+    segments = find_log_segments(args.index, log_name=args.log, pod_id=args.pod, start=args.start, end=args.end)
+    for entry in segments:
+        if args.dump:
+            opener = gzip.open if entry["segment"].endswith(COMPRESSED_SUFFIX) else open
+            with opener(entry["segment"], "rb") as stream:
+                sys.stdout.buffer.write(stream.read())
+        else:
+            print("%s %s %s %s %8d %s" % (entry["log"], entry["pod"],
+                                          datetime.fromtimestamp(entry["start"]).isoformat(timespec="seconds"),
+                                          datetime.fromtimestamp(entry["end"]).isoformat(timespec="seconds"),
+                                          entry["size"], entry["segment"]))
+
+
+if __name__ == '__main__':
+    main()
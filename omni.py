@@ -6,7 +6,11 @@ import simplejson as json
 from Crypto.Cipher import AES
 import os
 import base64
+import hashlib
+import hmac
+import time
 import argparse
+import fcntl
 
 ROOT_URL = "http://127.0.0.1:4444"
 
@@ -14,10 +18,12 @@ configureLogging()
 logger = getLogger()
 
 
-def get_auth_params():
+def _read_key():
     with open(DATA_PATH + KEY_FILE, "rb") as keyfile:
-        key = keyfile.read(32)
+        return keyfile.read(32)
 
+
+def get_token_auth_params(key):
     r = requests.get(ROOT_URL + REST_URL_TOKEN, timeout=20)
     j = json.loads(r.text)
     token = base64.b64decode(j["response"]["token"])
@@ -31,8 +37,61 @@ def get_auth_params():
     return {"auth": auth, "i": iv}
 
 
+def _open_session(key):
+    r = requests.get(ROOT_URL + REST_URL_SESSION, params=get_token_auth_params(key), timeout=20)
+    j = json.loads(r.text)
+    if not j["success"]:
+        raise Exception("Failed to open session: %s" % r.text)
+    return {"session": j["response"]["session"], "expires": j["response"]["expires"],
+            "uses": j["response"]["uses"], "seq": 0}
+
+
+def _load_session():
+    try:
+        with open(DATA_PATH + SESSION_FILE, "r") as stream:
+            return json.load(stream)
+    except Exception:
+        return None
+
+
+def _save_session(session):
+    with open(DATA_PATH + SESSION_FILE, "w") as stream:
+        json.dump(session, stream)
+
+
+def get_auth_params(renew=False):
+    key = _read_key()
+
+    with open(DATA_PATH + SESSION_FILE + SESSION_LOCK_SUFFIX, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        session = None
+        if not renew:
+            session = _load_session()
+        if session is None or session["uses"] <= 0 or session["expires"] < time.time() + 60:
+            session = _open_session(key)
+
+        session["seq"] += 1
+        session["uses"] -= 1
+        _save_session(session)
+
+    session_id = base64.b64decode(session["session"])
+    session_key = hmac.new(key, session_id, hashlib.sha256).digest()
+    sig = hmac.new(session_key, session_id + session["seq"].to_bytes(4, "big"), hashlib.sha256).digest()
+    return {"session": session["session"], "seq": session["seq"], "sig": base64.b64encode(sig)}
+
+
 def call_api(root, path, pa):
     r = requests.get(root + path, params = pa)
+    j = json.loads(r.text)
+    if not j["success"]:
+        error_message = j["response"].get("error_message")
+        if error_message == "Invalid session":
+            pa.update(get_auth_params(renew=True))
+            r = requests.get(root + path, params = pa)
+        elif error_message == "Invalid session signature":
+            # another invocation's later sequence number reached the api first
+            pa.update(get_auth_params())
+            r = requests.get(root + path, params = pa)
     print(r.text)
 
 
@@ -0,0 +1,151 @@
+from .protocol_common import RadioPacket, RadioPacketType, PodMessage
+from .exceptions import ProtocolError
+from .definitions import *
+from threading import Lock
+import struct
+import time
+
+CAPTURE_MAGIC = b"OMNICAP\x01"
+
+# timestamp, flags, rssi, data length
+CAPTURE_RECORD = struct.Struct(">dBBH")
+
+CAPTURE_SEND = 0x00
+CAPTURE_RECEIVE = 0x01
+CAPTURE_FLAG_RSSI = 0x80
+
+packet_captures = {}
+packet_captures_lock = Lock()
+
+
+class PacketCapture:
+    def __init__(self, path):
+        self.path = path
+        self.stream = None
+        self.lock = Lock()
+
+    def write(self, direction, data, rssi=None):
+        flags = direction
+        if rssi is None:
+            rssi = 0
+        else:
+            flags |= CAPTURE_FLAG_RSSI
+
+        with self.lock:
+            try:
+                if self.stream is None:
+                    self._open()
+                self.stream.write(CAPTURE_RECORD.pack(time.time(), flags, rssi, len(data)))
+                self.stream.write(data)
+            except Exception:
+                getLogger().exception("Error while writing packet capture")
+
+    def sent(self, data):
+        self.write(CAPTURE_SEND, data)
+
+    def received(self, data):
+        if data is None or len(data) < 2:
+            return
+        self.write(CAPTURE_RECEIVE, data[2:], data[0])
+
+    def flush(self):
+        with self.lock:
+            try:
+                if self.stream is not None:
+                    self.stream.flush()
+            except Exception:
+                getLogger().exception("Error while flushing packet capture")
+
+    def close(self):
+        with self.lock:
+            try:
+                if self.stream is not None:
+                    self.stream.close()
+            except Exception:
+                getLogger().exception("Error while closing packet capture")
+            finally:
+                self.stream = None
+
+    def _open(self):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.stream = open(self.path, "ab")
+        if new_file:
+            self.stream.write(CAPTURE_MAGIC)
+
+
+def get_packet_capture(pod_id=None):
+    with packet_captures_lock:
+        if pod_id not in packet_captures:
+            ensure_log_dir()
+            path = DATA_PATH + OMNIPY_PACKET_CAPTURE_FILE
+            if pod_id is not None:
+                path += "_" + pod_id
+            packet_captures[pod_id] = PacketCapture(path + PACKET_CAPTURE_SUFFIX)
+
+        return packet_captures[pod_id]
+
+
+def close_packet_captures():
+    with packet_captures_lock:
+        captures = list(packet_captures.values())
+    for capture in captures:
+        capture.close()
+
+
+def read_capture(path):
+    with open(path, "rb") as stream:
+        if stream.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ProtocolError("Not a packet capture file: %s" % path)
+
+        while True:
+            header = stream.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                break
+            timestamp, flags, rssi, length = CAPTURE_RECORD.unpack(header)
+            data = stream.read(length)
+            if len(data) < length:
+                break
+            if flags & CAPTURE_FLAG_RSSI == 0:
+                rssi = None
+            yield timestamp, flags & 0x7F, rssi, data
+
+
+def replay_capture(path, stats=None):
+    messages = {CAPTURE_SEND: None, CAPTURE_RECEIVE: None}
+    previous = {CAPTURE_SEND: None, CAPTURE_RECEIVE: None}
+    if stats is None:
+        stats = {}
+    stats["bad_packets"] = 0
+
+    for timestamp, direction, rssi, data in read_capture(path):
+        try:
+            packet = RadioPacket.parse(data)
+        except Exception:
+            getLogger().debug("Skipping unparseable packet %s", data.hex())
+            packet = None
+        if packet is None:
+            stats["bad_packets"] += 1
+            continue
+
+        last = previous[direction]
+        if last is not None and last.type == packet.type and last.sequence == packet.sequence:
+            continue
+        previous[direction] = packet
+
+        if packet.type == RadioPacketType.PDM or packet.type == RadioPacketType.POD:
+            messages[direction] = PodMessage()
+        elif packet.type != RadioPacketType.CON or messages[direction] is None:
+            continue
+
+        message = messages[direction]
+        try:
+            complete = message.add_radio_packet(packet)
+        except Exception:
+            getLogger().debug("Skipping packet that does not fit a message: %s", packet)
+            stats["bad_packets"] += 1
+            messages[direction] = None
+            continue
+
+        if complete:
+            messages[direction] = None
+            yield timestamp, direction, message
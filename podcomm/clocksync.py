@@ -0,0 +1,55 @@
+from .definitions import *
+from itertools import count
+import statistics
+import time
+
+
+class ClockSync:
+    def __init__(self, capacity=CLOCK_SYNC_SAMPLES):
+        self.capacity = capacity
+        self.samples = [None] * capacity
+        self.counter = count()
+        self.logger = getLogger()
+
+    def record(self, offset_ms):
+        self.samples[next(self.counter) % self.capacity] = (time.time(), offset_ms)
+
+    def get_samples(self, max_age=CLOCK_SYNC_MAX_AGE):
+        oldest = time.time() - max_age
+        return [s[1] for s in self.samples if s is not None and s[0] >= oldest]
+
+    def estimate(self, max_age=CLOCK_SYNC_MAX_AGE):
+        offsets = self.get_samples(max_age)
+        if len(offsets) < CLOCK_SYNC_MIN_SAMPLES:
+            return None
+        return statistics.median(offsets)
+
+    def apply(self, pdm):
+        offset_ms = self.estimate()
+        if offset_ms is None:
+            return False
+
+        if abs(offset_ms) > CLOCK_SYNC_THRESHOLD_MS:
+            adjustment = offset_ms / 1000
+        else:
+            adjustment = 0
+
+        if abs(adjustment - pdm.time_adjustment) * 1000 < CLOCK_SYNC_THRESHOLD_MS:
+            return False
+
+        self.logger.info("Adjusting local time by %d ms" % (adjustment * 1000))
+        pdm.set_time_adjustment(adjustment)
+        return True
+
+    def get_info(self, pdm=None):
+        offsets = sorted(self.get_samples())
+        info = {"samples": len(offsets),
+                "offset_ms": self.estimate(),
+                "local_time": time.time(),
+                "adjustment": None}
+        if len(offsets) > 0:
+            info["min_offset_ms"] = offsets[0]
+            info["max_offset_ms"] = offsets[-1]
+        if pdm is not None:
+            info["adjustment"] = pdm.time_adjustment
+        return info
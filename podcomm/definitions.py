@@ -1,7 +1,12 @@
 from enum import IntEnum
 import os
 import logging
-from logging.handlers import MemoryHandler
+import atexit
+import copy
+import time
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
+from queue import Queue, Full
+from .logstore import SegmentedLogHandler
 
 DATA_PATH = "./data/"
 
@@ -12,6 +17,8 @@ POD_FILE = "pod"
 POD_FILE_SUFFIX = ".json"
 
 POD_DB_SUFFIX = ".db"
+POD_JOURNAL_SUFFIX = ".journal"
+PODS_CONFIG_FILE = "pods.json"
 LOGFILE_SUFFIX = ".log"
 
 OMNIPY_LOGGER = "OMNIPY"
@@ -20,8 +27,99 @@ OMNIPY_LOGFILE = "omnipy"
 OMNIPY_PACKET_LOGGER = "OMNIPACKET"
 OMNIPY_PACKET_LOGFILE = "packet"
 
+OMNIPY_PACKET_CAPTURE_FILE = "packet"
+PACKET_CAPTURE_SUFFIX = ".cap"
+
 OMNIPY_DATABASE = "omni.db"
 
+LOG_QUEUE_SIZE = 10000
+LOG_FLUSH_TIMEOUT = 5
+
+LOG_INDEX_FILE = "logindex.json"
+LOG_SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+LOG_SEGMENT_MAX_AGE = 12 * 3600
+LOG_STORAGE_MAX_BYTES = 256 * 1024 * 1024
+
+REST_API_HOST = "0.0.0.0"
+REST_API_PORT = 4444
+REST_API_WORKERS = 8
+REST_API_STREAMS = 4
+REST_API_KEEPALIVE_TIMEOUT = 15
+REST_API_DRAIN_TIMEOUT = 30
+REST_API_IDLE_TIMEOUT = 120
+REST_API_COMPRESS_MIN_BYTES = 512
+REST_API_COMPRESS_LEVEL = 6
+
+RADIO_STATS_CAPACITY = 256
+RADIO_STOP_TIMEOUT = 10
+RADIO_POOL_WINDOW = 32
+RADIO_POOL_FAILOVER_ERRORS = 2
+RADIO_POOL_ERROR_PENALTY = 5.0
+RADIO_POOL_RECONNECT_INTERVAL = 60
+RADIO_TEARDOWN_WINDOW = 32
+RADIO_TEARDOWN_MIN_SAMPLES = 8
+RADIO_TEARDOWN_QUANTILE = 0.9
+RADIO_TEARDOWN_MARGIN = 0.3
+RADIO_TEARDOWN_MIN_PREEMPT = 0.3
+RADIO_TEARDOWN_MAX_PREEMPT = 3.5
+RADIO_TEARDOWN_MIN_SILENCE = 0.3
+RADIO_TEARDOWN_MAX_SILENCE = 0.6
+RADIO_TEARDOWN_PROBE_INTERVAL = 8
+LISTEN_TUNE_COLD_AFTER = 4
+LISTEN_TUNE_COLD_CANDIDATES = [(300, 1, 300), (300, 1, 200), (250, 1, 150), (300, 0, 300)]
+LISTEN_TUNE_WARM_CANDIDATES = [(120, 0, 40), (100, 0, 30), (80, 0, 20), (150, 0, 60)]
+LISTEN_TUNE_WINDOW = 64
+LISTEN_TUNE_MIN_SAMPLES = 8
+LISTEN_TUNE_MIN_SUCCESS = 0.8
+LISTEN_TUNE_EXPLORE = 0.1
+
+TX_POWER_LEVEL_COUNT = 9
+TX_POWER_DEFAULT_LEVEL = 6
+TX_POWER_WINDOW = 32
+TX_POWER_MIN_SAMPLES = 8
+TX_POWER_MAX_AGE = 6 * 3600
+TX_POWER_MIN_SUCCESS_RATE = 0.9
+TX_POWER_RAISE_RETRIES = 1.0
+TX_POWER_LOWER_RETRIES = 0.1
+TX_POWER_STRONG_RSSI = -60
+
+# "adaptive" is experimental: it shortens timeouts at low packet loss but does worse than
+# the default ladder above ~60% loss in tests/sim_retry.py
+RADIO_RETRY_POLICY = "default"
+RETRY_HISTORY = 32
+RETRY_MIN_HISTORY = 8
+RETRY_MISS_PROBABILITY = 0.01
+RETRY_TIMEOUT_GROWTH = 1.5
+RETRY_MIN_TIMEOUT = 5
+RETRY_MAX_TIMEOUT = 20
+RETRY_MIN_DELAY = 0.5
+RETRY_RADIO_ERROR_RATE = 0.25
+
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CLOCK_SYNC_SAMPLES = 32
+CLOCK_SYNC_MIN_SAMPLES = 4
+CLOCK_SYNC_MAX_AGE = 3600
+CLOCK_SYNC_THRESHOLD_MS = 30000
+CLOCK_SYNC_INTERVAL = 60
+
+EVENT_STREAM_CAPACITY = 64
+EVENT_STREAM_KEEPALIVE = 15
+EVENT_POLL_TIMEOUT = 30
+
+BATCH_STATUS_MAX_AGE = 60
+STATUS_PIGGYBACK = True
+STATUS_PIGGYBACK_MAX_AGE = 30
+STATUS_FLIGHT_TIMEOUT = 30
+
+TOKEN_TTL = 300
+TOKEN_STORE_SIZE = 256
+SESSION_TTL = 3600
+SESSION_MAX_USES = 1000
+SESSION_STORE_SIZE = 16
+SESSION_FILE = "session"
+SESSION_LOCK_SUFFIX = ".lock"
+
 API_VERSION_MAJOR = 1
 API_VERSION_MINOR = 4
 API_VERSION_REVISION = 0
@@ -35,14 +133,19 @@ REST_URL_OMNIPY_WIFI = "/omnipy/updatewlan"
 REST_URL_OMNIPY_CHANGE_PASSWORD = "/omnipy/changepw"
 
 REST_URL_TOKEN = "/omnipy/token"
+REST_URL_SESSION = "/omnipy/session"
 REST_URL_CHECK_PASSWORD = "/omnipy/pwcheck"
+REST_URL_CLOCK = "/omnipy/clock"
 
 REST_URL_NEW_POD = "/omnipy/newpod"
 REST_URL_SET_POD_PARAMETERS = "/omnipy/parameters"
 REST_URL_GET_PDM_ADDRESS = "/omnipy/pdmspy"
+REST_URL_PODS = "/omnipy/pods"
 
 REST_URL_RL_INFO = "/rl/info"
 
+REST_URL_METRICS = "/metrics"
+
 REST_URL_SILENCE_ALARMS = "/pdm/silence"
 REST_URL_ARCHIVE_POD = "/pdm/archive"
 REST_URL_PAIR_POD = "/pdm/pair"
@@ -50,6 +153,7 @@ REST_URL_ACTIVATE_POD = "/pdm/activate"
 REST_URL_START_POD = "/pdm/start"
 REST_URL_STATUS = "/pdm/status"
 REST_URL_PDM_BUSY = "/pdm/isbusy"
+REST_URL_RADIO_STATS = "/pdm/radiostats"
 REST_URL_ACK_ALERTS = "/pdm/ack"
 REST_URL_DEACTIVATE_POD = "/pdm/deactivate"
 REST_URL_BOLUS = "/pdm/bolus"
@@ -57,9 +161,35 @@ REST_URL_CANCEL_BOLUS = "/pdm/cancelbolus"
 REST_URL_SET_TEMP_BASAL = "/pdm/settempbasal"
 REST_URL_CANCEL_TEMP_BASAL = "/pdm/canceltempbasal"
 REST_URL_SET_BASAL_SCHEDULE = "/pdm/setbasalschedule"
+REST_URL_EVENTS = "/pdm/events"
+REST_URL_BATCH = "/pdm/batch"
 
 logger = None
 packet_logger = None
+log_listeners = {}
+log_exception_formatter = logging.Formatter()
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, queue):
+        QueueHandler.__init__(self, queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = log_exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
 
 
 def ensure_log_dir():
@@ -67,6 +197,80 @@ def ensure_log_dir():
         os.mkdir(DATA_PATH)
 
 
+def _attach_log_queue(target_logger, handlers):
+    q = Queue(LOG_QUEUE_SIZE)
+    target_logger.addHandler(DroppingQueueHandler(q))
+    listener = QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    log_listeners[target_logger.name] = listener
+
+
+def _join_log_queue(listener, timeout=LOG_FLUSH_TIMEOUT):
+    q = listener.queue
+    deadline = time.time() + timeout
+    with q.all_tasks_done:
+        while q.unfinished_tasks > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            q.all_tasks_done.wait(remaining)
+    return True
+
+
+def flush_logger(target_logger, close=False):
+    listener = log_listeners.get(target_logger.name)
+    if listener is None:
+        handlers = target_logger.handlers
+    else:
+        _join_log_queue(listener)
+        for handler in target_logger.handlers:
+            if isinstance(handler, DroppingQueueHandler) and handler.dropped > 0:
+                dropped = handler.dropped
+                handler.dropped = 0
+                target_logger.warning("%d log records were dropped due to a full log queue", dropped)
+                _join_log_queue(listener)
+        handlers = listener.handlers
+
+    for handler in handlers:
+        handler.flush()
+        if close and isinstance(handler, logging.FileHandler):
+            handler.close()
+
+
+def rotate_logger(target_logger):
+    listener = log_listeners.get(target_logger.name)
+    if listener is None:
+        return
+
+    _join_log_queue(listener)
+    for handler in listener.handlers:
+        if isinstance(handler, SegmentedLogHandler):
+            handler.acquire()
+            try:
+                handler.doRollover()
+            finally:
+                handler.release()
+
+
+def _segmented_log_handler(log_name):
+    return SegmentedLogHandler(DATA_PATH + log_name + LOGFILE_SUFFIX, log_name, DATA_PATH + LOG_INDEX_FILE,
+                               max_bytes=LOG_SEGMENT_MAX_BYTES, max_age=LOG_SEGMENT_MAX_AGE,
+                               max_total_bytes=LOG_STORAGE_MAX_BYTES)
+
+
+def _stop_log_listeners():
+    for name in list(log_listeners.keys()):
+        listener = log_listeners.pop(name)
+        try:
+            _join_log_queue(listener)
+            listener.stop()
+        except Exception:
+            pass
+
+
+atexit.register(_stop_log_listeners)
+
+
 def getLogger(with_console=False):
     global logger
 
@@ -75,17 +279,20 @@ def getLogger(with_console=False):
         logger = logging.getLogger(OMNIPY_LOGGER)
         logger.setLevel(logging.DEBUG)
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        handlers = []
 
-        fh = logging.FileHandler(DATA_PATH + OMNIPY_LOGFILE + LOGFILE_SUFFIX)
+        fh = _segmented_log_handler(OMNIPY_LOGFILE)
         fh.setLevel(logging.DEBUG)
         fh.setFormatter(formatter)
-        logger.addHandler(fh)
+        handlers.append(fh)
 
         if with_console:
             ch = logging.StreamHandler()
             ch.setLevel(logging.DEBUG)
             ch.setFormatter(formatter)
-            logger.addHandler(ch)
+            handlers.append(ch)
+
+        _attach_log_queue(logger, handlers)
 
     return logger
 
@@ -98,17 +305,20 @@ def get_packet_logger(with_console=False):
         packet_logger = logging.getLogger(OMNIPY_PACKET_LOGGER)
         packet_logger.setLevel(logging.INFO)
         formatter = logging.Formatter('%(asctime)s %(message)s')
+        handlers = []
 
-        fh = logging.FileHandler(DATA_PATH + OMNIPY_PACKET_LOGFILE + LOGFILE_SUFFIX)
+        fh = _segmented_log_handler(OMNIPY_PACKET_LOGFILE)
         fh.setLevel(logging.INFO)
         fh.setFormatter(formatter)
-        packet_logger.addHandler(fh)
+        handlers.append(fh)
 
         if with_console:
             ch = logging.StreamHandler()
             ch.setLevel(logging.DEBUG)
             ch.setFormatter(formatter)
-            packet_logger.addHandler(ch)
+            handlers.append(ch)
+
+        _attach_log_queue(packet_logger, handlers)
 
     return packet_logger
 
@@ -0,0 +1,58 @@
+from collections import deque
+from threading import Condition
+from .definitions import EVENT_STREAM_CAPACITY
+import time
+
+event_stream = None
+
+
+class PodEvent:
+    def __init__(self, version, event_type, data, pod_id=None):
+        self.version = version
+        self.event_type = event_type
+        self.data = data
+        self.pod_id = pod_id
+        self.timestamp = time.time()
+
+
+class PodEventStream:
+    def __init__(self, capacity=EVENT_STREAM_CAPACITY):
+        self.events = deque(maxlen=capacity)
+        self.version = 0
+        self.epoch = int(time.time())
+        self.condition = Condition()
+
+    def publish(self, event_type, data, pod_id=None):
+        with self.condition:
+            self.version += 1
+            self.events.append(PodEvent(self.version, event_type, data, pod_id))
+            self.condition.notify_all()
+
+    def get_cursor(self, since=None, epoch=None):
+        with self.condition:
+            if since is None:
+                return self.version
+            if (epoch is not None and epoch != self.epoch) or since > self.version:
+                return 0
+            return since
+
+    def get_events(self, since=0, pod_id=None):
+        with self.condition:
+            return self._select(since, pod_id)
+
+    def wait_events(self, since=0, timeout=None, pod_id=None):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self._select(since, pod_id)) > 0, timeout=timeout)
+            return self._select(since, pod_id)
+
+    def _select(self, since, pod_id):
+        return [e for e in self.events if e.version > since and (pod_id is None or e.pod_id == pod_id)]
+
+
+def get_event_stream():
+    global event_stream
+
+    if event_stream is None:
+        event_stream = PodEventStream()
+
+    return event_stream
@@ -0,0 +1,138 @@
+from .crc import crc16
+from .definitions import *
+import struct
+import time
+
+# timestamp, radio address, message sequence, packet sequence, flags, last nonce, nonce seed, lot, tid
+JOURNAL_RECORD = struct.Struct(">dIBBBIHII")
+JOURNAL_RECORD_SIZE = JOURNAL_RECORD.size + 2
+
+JOURNAL_FLAG_NONCE = 0x01
+JOURNAL_FLAG_POD_ID = 0x02
+
+
+def get_journal_path(pod_path):
+    return os.path.splitext(pod_path)[0] + POD_JOURNAL_SUFFIX
+
+
+class SequenceJournal:
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.nonce_last = None
+        self.nonce_seed = 0
+        self.id_lot = None
+        self.id_t = None
+        self.synced_state = None
+        self.logger = getLogger()
+
+    def set_nonce(self, nonce_last, nonce_seed):
+        self.nonce_last = nonce_last
+        self.nonce_seed = nonce_seed
+
+    def set_pod_id(self, id_lot, id_t):
+        self.id_lot = id_lot
+        self.id_t = id_t
+
+    def reset(self):
+        self.close()
+        self.synced_state = None
+        try:
+            if os.path.exists(self.path):
+                os.truncate(self.path, 0)
+        except Exception:
+            self.logger.exception("Error while resetting the sequence journal")
+
+    def record(self, radio_address, message_sequence, packet_sequence):
+        try:
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            os.write(self.fd, self._pack(radio_address, message_sequence, packet_sequence))
+            synced_state = self._get_synced_state(radio_address, message_sequence)
+            if synced_state != self.synced_state:
+                os.fsync(self.fd)
+                self.synced_state = synced_state
+        except Exception:
+            self.logger.exception("Error while writing to the sequence journal")
+
+    def compact(self, radio_address, message_sequence, packet_sequence):
+        temp_path = self.path + ".tmp"
+        try:
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                os.write(fd, self._pack(radio_address, message_sequence, packet_sequence))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.close()
+            os.replace(temp_path, self.path)
+            self.synced_state = self._get_synced_state(radio_address, message_sequence)
+        except Exception:
+            self.logger.exception("Error while compacting the sequence journal")
+            self.record(radio_address, message_sequence, packet_sequence)
+
+    def replay(self):
+        try:
+            with open(self.path, "rb") as stream:
+                data = stream.read()
+        except FileNotFoundError:
+            return None
+
+        end = len(data) - len(data) % JOURNAL_RECORD_SIZE
+        while end > 0:
+            record = data[end - JOURNAL_RECORD_SIZE:end]
+            end -= JOURNAL_RECORD_SIZE
+            if struct.unpack(">H", record[-2:])[0] != crc16(record[:-2]):
+                self.logger.warning("Skipping damaged sequence journal record")
+                continue
+
+            timestamp, radio_address, message_sequence, packet_sequence, flags, nonce_last, nonce_seed, \
+                id_lot, id_t = JOURNAL_RECORD.unpack(record[:-2])
+            if flags & JOURNAL_FLAG_NONCE == 0:
+                nonce_last = None
+            if flags & JOURNAL_FLAG_POD_ID == 0:
+                id_lot = None
+                id_t = None
+            return {"timestamp": timestamp,
+                    "radio_address": radio_address,
+                    "message_sequence": message_sequence,
+                    "packet_sequence": packet_sequence,
+                    "nonce_last": nonce_last,
+                    "nonce_seed": nonce_seed,
+                    "id_lot": id_lot,
+                    "id_t": id_t}
+        return None
+
+    def close(self):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+    def _get_synced_state(self, radio_address, message_sequence):
+        # packet sequences are resynchronized by the pod, only message sequence and
+        # nonce changes have to reach the disk before the packet is sent
+        return radio_address, message_sequence, self.nonce_last, self.nonce_seed, self.id_lot, self.id_t
+
+    def _pack(self, radio_address, message_sequence, packet_sequence):
+        flags = 0
+        nonce_last = 0
+        if self.nonce_last is not None:
+            flags |= JOURNAL_FLAG_NONCE
+            nonce_last = self.nonce_last
+        nonce_seed = self.nonce_seed if self.nonce_seed is not None else 0
+        id_lot = 0
+        id_t = 0
+        if self.id_lot is not None and self.id_t is not None:
+            flags |= JOURNAL_FLAG_POD_ID
+            id_lot = self.id_lot
+            id_t = self.id_t
+        if radio_address is None:
+            radio_address = 0
+        data = JOURNAL_RECORD.pack(time.time(), radio_address & 0xffffffff,
+                                   message_sequence & 0xff, packet_sequence & 0xff,
+                                   flags, nonce_last, nonce_seed & 0xffff,
+                                   id_lot & 0xffffffff, id_t & 0xffffffff)
+        return data + struct.pack(">H", crc16(data))
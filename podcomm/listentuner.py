@@ -0,0 +1,97 @@
+from .definitions import *
+import random
+
+
+def _setting_key(setting):
+    return "%d,%d,%d" % setting
+
+
+class ListenTuner:
+    def __init__(self, state=None, rng=None):
+        self.candidates = {"cold": LISTEN_TUNE_COLD_CANDIDATES, "warm": LISTEN_TUNE_WARM_CANDIDATES}
+        self.stats = {"cold": {}, "warm": {}}
+        if state is not None:
+            for regime in self.stats:
+                for key, value in state.get(regime, {}).items():
+                    self.stats[regime][key] = list(value)
+        if rng is None:
+            rng = random.Random()
+        self.rng = rng
+
+    def get_regime(self, last_packet_timestamp, now):
+        if last_packet_timestamp is None or now - last_packet_timestamp > LISTEN_TUNE_COLD_AFTER:
+            return "cold"
+        return "warm"
+
+    def get_default(self, regime):
+        return self.candidates[regime][0]
+
+    def select(self, regime):
+        untried = [s for s in self.candidates[regime]
+                   if self._get(regime, s)[0] < LISTEN_TUNE_MIN_SAMPLES]
+        if len(untried) > 0 and self.rng.random() < LISTEN_TUNE_EXPLORE:
+            return self.rng.choice(untried)
+        return self.get_best(regime)
+
+    def get_best(self, regime):
+        best = self.get_default(regime)
+        best_cost = self._expected_cost(regime, best)
+        for setting in self.candidates[regime][1:]:
+            tries, successes, _ = self._get(regime, setting)
+            if tries < LISTEN_TUNE_MIN_SAMPLES or successes / tries < LISTEN_TUNE_MIN_SUCCESS:
+                continue
+            cost = self._expected_cost(regime, setting)
+            if best_cost is None or cost < best_cost:
+                best = setting
+                best_cost = cost
+        return best
+
+    def record(self, regime, setting, success, latency):
+        entry = self._get(regime, setting)
+        entry[0] += 1
+        if success:
+            entry[1] += 1
+            entry[2] += latency
+        if entry[0] > LISTEN_TUNE_WINDOW:
+            entry[0] /= 2
+            entry[1] /= 2
+            entry[2] /= 2
+        self.stats[regime][_setting_key(setting)] = entry
+
+    def get_state(self):
+        return {regime: {key: list(value) for key, value in stats.items()}
+                for regime, stats in self.stats.items()}
+
+    def get_summary(self):
+        summary = {}
+        for regime, candidates in self.candidates.items():
+            best = self.get_best(regime)
+            settings = []
+            for setting in candidates:
+                tries, successes, latency = self._get(regime, setting)
+                entry = {"timeout_ms": setting[0], "retry_count": setting[1], "preamble_ext_ms": setting[2],
+                         "samples": tries, "success_rate": None, "latency": None,
+                         "chosen": setting == best}
+                if tries > 0:
+                    entry["success_rate"] = successes / tries
+                if successes > 0:
+                    entry["latency"] = latency / successes
+                settings.append(entry)
+            summary[regime] = settings
+        return summary
+
+    def _get(self, regime, setting):
+        return list(self.stats[regime].get(_setting_key(setting), [0, 0, 0.0]))
+
+    def _failure_cost(self, setting):
+        timeout_ms, retry_count, preamble_ext_ms = setting
+        return (retry_count + 1) * (timeout_ms + preamble_ext_ms) / 1000
+
+    def _expected_cost(self, regime, setting):
+        tries, successes, latency = self._get(regime, setting)
+        if tries == 0 or successes == 0:
+            return None
+        success_rate = successes / tries
+        fallback = self._failure_cost(self.get_default(regime))
+        return success_rate * latency / successes + \
+            (1 - success_rate) * (self._failure_cost(setting) + fallback)
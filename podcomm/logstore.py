@@ -0,0 +1,184 @@
+from logging.handlers import BaseRotatingHandler
+from datetime import datetime
+from threading import Thread, Lock
+from queue import Queue
+import simplejson as json
+import gzip
+import shutil
+import time
+import os
+
+COMPRESSED_SUFFIX = ".gz"
+
+g_index_lock = Lock()
+g_compress_queue = None
+g_compress_pending = set()
+g_pod_id = None
+
+
+def set_log_pod_id(pod_id):
+    global g_pod_id
+    g_pod_id = pod_id
+
+
+def get_log_pod_id():
+    return g_pod_id
+
+
+def _read_index(index_path):
+    try:
+        with open(index_path, "r") as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return []
+
+
+def _write_index(index_path, entries):
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "w") as stream:
+        json.dump(entries, stream, indent=4)
+    os.replace(temp_path, index_path)
+
+
+def add_log_segment(index_path, entry):
+    with g_index_lock:
+        entries = _read_index(index_path)
+        entries.append(entry)
+        _write_index(index_path, entries)
+
+
+def find_log_segments(index_path, log_name=None, pod_id=None, start=None, end=None):
+    with g_index_lock:
+        entries = _read_index(index_path)
+
+    found = []
+    for entry in entries:
+        if log_name is not None and entry["log"] != log_name:
+            continue
+        if pod_id is not None and entry["pod"] != pod_id:
+            continue
+        if start is not None and entry["end"] < start:
+            continue
+        if end is not None and entry["start"] > end:
+            continue
+        found.append(entry)
+    return found
+
+
+def _compress_segment(index_path, segment, max_total_bytes):
+    compressed = segment + COMPRESSED_SUFFIX
+    with open(segment, "rb") as source, gzip.open(compressed, "wb") as target:
+        shutil.copyfileobj(source, target)
+    os.remove(segment)
+
+    with g_index_lock:
+        entries = _read_index(index_path)
+        for entry in entries:
+            if entry["segment"] == segment:
+                entry["segment"] = compressed
+                entry["size"] = os.path.getsize(compressed)
+
+        total = 0
+        kept = []
+        for entry in reversed(entries):
+            total += entry["size"]
+            if max_total_bytes > 0 and total > max_total_bytes:
+                try:
+                    os.remove(entry["segment"])
+                except OSError:
+                    pass
+            else:
+                kept.append(entry)
+        kept.reverse()
+        _write_index(index_path, kept)
+
+
+def _compress_loop():
+    while True:
+        index_path, segment, max_total_bytes = g_compress_queue.get()
+        try:
+            _compress_segment(index_path, segment, max_total_bytes)
+        except Exception:
+            from .definitions import getLogger
+            getLogger().exception("Error while compressing log segment %s", segment)
+        finally:
+            with g_index_lock:
+                g_compress_pending.discard(segment)
+            g_compress_queue.task_done()
+
+
+def _compress_later(index_path, segment, max_total_bytes):
+    global g_compress_queue
+    with g_index_lock:
+        if segment in g_compress_pending:
+            return
+        g_compress_pending.add(segment)
+        if g_compress_queue is None:
+            g_compress_queue = Queue()
+            Thread(target=_compress_loop, daemon=True).start()
+    g_compress_queue.put((index_path, segment, max_total_bytes))
+
+
+def _compress_leftover_segments(index_path, log_name, max_total_bytes):
+    with g_index_lock:
+        entries = _read_index(index_path)
+    for entry in entries:
+        segment = entry["segment"]
+        if entry["log"] == log_name and not segment.endswith(COMPRESSED_SUFFIX) and os.path.exists(segment):
+            _compress_later(index_path, segment, max_total_bytes)
+
+
+def wait_for_compression():
+    if g_compress_queue is not None:
+        g_compress_queue.join()
+
+
+class SegmentedLogHandler(BaseRotatingHandler):
+    def __init__(self, filename, log_name, index_path, max_bytes=0, max_age=0, max_total_bytes=0):
+        BaseRotatingHandler.__init__(self, filename, "a", delay=True)
+        self.log_name = log_name
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_total_bytes = max_total_bytes
+        self.segment_start = time.time()
+        if os.path.exists(self.baseFilename):
+            self.segment_start = min(self.segment_start, os.path.getmtime(self.baseFilename))
+        _compress_leftover_segments(index_path, log_name, max_total_bytes)
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.stream.tell() == 0:
+            return False
+        if self.max_bytes > 0 and self.stream.tell() >= self.max_bytes:
+            return True
+        if self.max_age > 0 and record.created - self.segment_start >= self.max_age:
+            return True
+        return False
+
+    def doRollover(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        now = time.time()
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            root, ext = os.path.splitext(self.baseFilename)
+            stamp = datetime.utcfromtimestamp(now).strftime("_%Y%m%d_%H%M%S")
+            segment = root + stamp + ext
+            counter = 0
+            while os.path.exists(segment) or os.path.exists(segment + COMPRESSED_SUFFIX):
+                counter += 1
+                segment = "%s%s_%d%s" % (root, stamp, counter, ext)
+
+            os.rename(self.baseFilename, segment)
+            add_log_segment(self.index_path, {"log": self.log_name,
+                                              "pod": get_log_pod_id(),
+                                              "start": self.segment_start,
+                                              "end": now,
+                                              "segment": segment,
+                                              "size": os.path.getsize(segment)})
+            _compress_later(self.index_path, segment, self.max_total_bytes)
+
+        self.segment_start = now
@@ -0,0 +1,162 @@
+from .pdm import Pdm, PdmLock
+from .pod import Pod
+from .pr_rileylink import RileyLink
+from .radiopool import RadioPool
+from .capture import get_packet_capture
+from .exceptions import PdmError
+from .definitions import *
+from datetime import datetime
+from threading import RLock, Lock
+import simplejson as json
+import re
+
+pdm_manager = None
+
+
+class PdmManager:
+    def __init__(self):
+        self.pdms = {}
+        self.rl_addresses = {}
+        self.lock = Lock()
+        self.logger = getLogger()
+
+    def load(self, path=DATA_PATH + PODS_CONFIG_FILE):
+        if not os.path.exists(path):
+            return
+        with open(path, "r") as stream:
+            config = json.load(stream)
+        for entry in config.get("pods", []):
+            self.add_pod(str(entry["id"]), entry.get("rileylink"))
+
+    def add_pod(self, pod_id, rl_address=None):
+        if re.fullmatch("[A-Za-z0-9_-]+", pod_id) is None:
+            raise PdmError("Invalid pod id: %s" % pod_id)
+
+        with self.lock:
+            if pod_id in self.pdms:
+                raise PdmError("Pod %s is already managed" % pod_id)
+            if isinstance(rl_address, list):
+                rl_addresses = rl_address
+            else:
+                rl_addresses = [rl_address]
+            if len(rl_addresses) == 0:
+                raise PdmError("No RileyLink defined for pod %s" % pod_id)
+            if len(rl_addresses) > 1 and None in rl_addresses:
+                raise PdmError("Pooled RileyLinks need an address")
+            assigned = self._get_assigned_addresses()
+            for address in rl_addresses:
+                if address in assigned or rl_addresses.count(address) > 1:
+                    if address is None:
+                        raise PdmError("Only one pod can be managed without a RileyLink address")
+                    raise PdmError("RileyLink %s is already assigned to another pod" % address)
+
+            self.logger.info("Managing pod %s on RileyLink %s" % (pod_id, rl_address))
+            if len(rl_addresses) == 1:
+                packet_radio = RileyLink(rl_addresses[0])
+            else:
+                packet_radio = RadioPool([RileyLink(address) for address in rl_addresses])
+            self.rl_addresses[pod_id] = rl_address
+            self.pdms[pod_id] = Pdm(self._load_pod(pod_id), lock=RLock(), packet_radio=packet_radio, pod_id=pod_id)
+            return self.pdms[pod_id]
+
+    def remove_pod(self, pod_id):
+        with self.lock:
+            pdm = self._get(pod_id)
+            del self.pdms[pod_id]
+            del self.rl_addresses[pod_id]
+        pdm.close()
+
+    def get_pdm(self, pod_id):
+        with self.lock:
+            return self._get(pod_id)
+
+    def get_rileylink_address(self, pod_id):
+        with self.lock:
+            self._get(pod_id)
+            address = self.rl_addresses[pod_id]
+            if isinstance(address, list):
+                return address[0]
+            return address
+
+    def get_pod_ids(self):
+        with self.lock:
+            return list(self.pdms.keys())
+
+    def get_summary(self):
+        with self.lock:
+            pdms = list(self.pdms.items())
+        return {pod_id: {"rileylink": self.rl_addresses.get(pod_id),
+                         "id_lot": pdm.pod.id_lot,
+                         "id_t": pdm.pod.id_t,
+                         "radio_address": pdm.pod.radio_address,
+                         "state_progress": pdm.pod.state_progress,
+                         "busy": pdm.is_busy()}
+                for pod_id, pdm in pdms}
+
+    def archive_pod(self, pod_id):
+        with self.lock:
+            pdm = self._get(pod_id)
+        with PdmLock(lock=pdm.lock):
+            pdm.close()
+            base = self._get_base_path(pod_id)
+            archive_suffix = datetime.utcnow().strftime("_%Y%m%d_%H%M%S")
+            archive_name = None
+            for suffix in [POD_FILE_SUFFIX, POD_DB_SUFFIX, POD_JOURNAL_SUFFIX]:
+                if os.path.isfile(base + suffix):
+                    os.rename(base + suffix, base + archive_suffix + suffix)
+                    if suffix == POD_FILE_SUFFIX:
+                        archive_name = base + archive_suffix + suffix
+
+            capture = get_packet_capture(pod_id)
+            capture.close()
+            if os.path.isfile(capture.path):
+                os.rename(capture.path, capture.path[:-len(PACKET_CAPTURE_SUFFIX)] + archive_suffix +
+                          PACKET_CAPTURE_SUFFIX)
+
+            with self.lock:
+                self.pdms[pod_id] = Pdm(self._load_pod(pod_id), lock=pdm.lock, packet_radio=pdm.packet_radio,
+                                        pod_id=pod_id)
+        return archive_name
+
+    def stop(self):
+        with self.lock:
+            pdms = list(self.pdms.values())
+        for pdm in pdms:
+            pdm.close()
+
+    def _get_assigned_addresses(self):
+        assigned = []
+        for address in self.rl_addresses.values():
+            if isinstance(address, list):
+                assigned.extend(address)
+            else:
+                assigned.append(address)
+        return assigned
+
+    def _get(self, pod_id):
+        if pod_id not in self.pdms:
+            raise PdmError("Unknown pod: %s" % pod_id)
+        return self.pdms[pod_id]
+
+    def _get_base_path(self, pod_id):
+        return DATA_PATH + POD_FILE + "_" + pod_id
+
+    def _load_pod(self, pod_id):
+        base = self._get_base_path(pod_id)
+        if os.path.exists(base + POD_FILE_SUFFIX):
+            return Pod.Load(base + POD_FILE_SUFFIX, base + POD_DB_SUFFIX)
+
+        pod = Pod()
+        pod.path = base + POD_FILE_SUFFIX
+        pod.path_db = base + POD_DB_SUFFIX
+        pod.Save()
+        return pod
+
+
+def get_manager():
+    global pdm_manager
+
+    if pdm_manager is None:
+        pdm_manager = PdmManager()
+
+    return pdm_manager
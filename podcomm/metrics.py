@@ -0,0 +1,118 @@
+from .definitions import METRICS_LATENCY_BUCKETS
+from bisect import bisect_left
+from threading import Lock
+
+metrics = None
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra is not None:
+        items.append(extra)
+    if len(items) == 0:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in items) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name):
+        with self.lock:
+            value = self.value
+        return ["%s%s %s" % (name, _format_labels(self.labels), _format_value(value))]
+
+
+class Histogram:
+    def __init__(self, labels, buckets=METRICS_LATENCY_BUCKETS):
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def render(self, name):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append("%s_bucket%s %d" % (name, _format_labels(self.labels, ("le", _format_value(bound))),
+                                              cumulative))
+        lines.append("%s_sum%s %s" % (name, _format_labels(self.labels), _format_value(total)))
+        lines.append("%s_count%s %d" % (name, _format_labels(self.labels), cumulative))
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.families = {}
+        self.lock = Lock()
+
+    def _get(self, metric_class, name, help_text, labels):
+        key = tuple(sorted(labels.items()))
+        family = self.families.get(name)
+        if family is not None:
+            metric = family[2].get(key)
+            if metric is not None:
+                return metric
+
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = (metric_class, help_text, {})
+                self.families[name] = family
+            metric = family[2].get(key)
+            if metric is None:
+                metric = metric_class(key)
+                family[2][key] = metric
+            return metric
+
+    def counter(self, name, help_text, **labels):
+        return self._get(Counter, name, help_text, labels)
+
+    def histogram(self, name, help_text, **labels):
+        return self._get(Histogram, name, help_text, labels)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            families = [(name, metric_class, help_text, sorted(children.items()))
+                        for name, (metric_class, help_text, children) in sorted(self.families.items())]
+        for name, metric_class, help_text, children in families:
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, "counter" if metric_class is Counter else "histogram"))
+            for key, metric in children:
+                lines.extend(metric.render(name))
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics():
+    global metrics
+
+    if metrics is None:
+        metrics = Metrics()
+
+    return metrics
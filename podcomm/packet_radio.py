@@ -43,6 +43,12 @@ class PacketRadio(abc.ABC):
     def set_tx_power(self, tx_power):
         pass
 
+    def get_tx_level(self):
+        return None
+
+    def set_tx_level(self, level):
+        pass
+
     @abc.abstractmethod
     def get_packet(self, timeout=5.0):
         pass
@@ -1,12 +1,16 @@
 from .protocol import *
 from .protocol_radio import PdmRadio
+from .journal import SequenceJournal, get_journal_path
+from .events import get_event_stream
+from .metrics import get_metrics
 from .nonce import *
 from .exceptions import PdmError, OmnipyError, PdmBusyError
 from .definitions import *
 from .packet_radio import TxPower
 from decimal import *
 from datetime import datetime, timedelta
-from threading import RLock
+from threading import RLock, Lock, Event
+import copy
 import time
 
 
@@ -14,34 +18,68 @@ g_lock = RLock()
 
 
 class PdmLock():
-    def __init__(self, timeout=2):
+    def __init__(self, timeout=2, lock=None):
         self.fd = None
         self.timeout = timeout
+        if lock is None:
+            lock = g_lock
+        self.lock = lock
 
     def __enter__(self):
-        if not g_lock.acquire(blocking=True, timeout=self.timeout):
+        if not self.lock.acquire(blocking=True, timeout=self.timeout):
             raise PdmBusyError()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        g_lock.release()
+        self.lock.release()
+
+
+class StatusFlight:
+    def __init__(self):
+        self.done = Event()
+        self.error = None
 
 
 class Pdm:
-    def __init__(self, pod):
+    def __init__(self, pod, lock=None, packet_radio=None, pod_id=None):
         if pod is None:
             raise PdmError("Cannot instantiate pdm without pod")
 
         self.pod = pod
+        if lock is None:
+            lock = g_lock
+        self.lock = lock
+        self.packet_radio = packet_radio
+        self.pod_id = pod_id
         self.nonce = None
         self.radio = None
         self.time_adjustment = 0
         self.logger = getLogger()
+        self.in_batch = False
+        self.batch_status_time = None
+        self.status_flights = {}
+        self.status_times = {}
+        self.flight_lock = Lock()
+        self.command_started = None
+        self.piggyback_status = STATUS_PIGGYBACK
+        self.response_status = None
+
+        self.journal = None
+        if pod.path is not None:
+            self.journal = SequenceJournal(get_journal_path(pod.path))
+            self._replay_journal()
+            self.journal.set_nonce(pod.nonce_last, pod.nonce_seed)
+            self.journal.set_pod_id(pod.id_lot, pod.id_t)
 
     def stop_radio(self):
         if self.radio is not None:
             self.radio.stop()
             self.radio = None
 
+    def close(self):
+        self.stop_radio()
+        if self.journal is not None:
+            self.journal.close()
+
     def start_radio(self):
         self.get_radio(new=True)
 
@@ -55,6 +93,11 @@ class Pdm:
                 self.nonce = Nonce(self.pod.id_lot, self.pod.id_t, self.pod.nonce_last, self.pod.nonce_seed)
         return self.nonce
 
+    def get_radio_stats(self):
+        if self.radio is None:
+            return {}
+        return self.radio.get_stats()
+
     def get_radio(self, new=False):
         if self.radio is not None and new:
             self.radio.stop()
@@ -67,24 +110,33 @@ class Pdm:
 
             self.radio = PdmRadio(self.pod.radio_address,
                                   msg_sequence=self.pod.radio_message_sequence,
-                                  pkt_sequence=self.pod.radio_packet_sequence)
+                                  pkt_sequence=self.pod.radio_packet_sequence,
+                                  packet_radio=self.packet_radio,
+                                  journal=self.journal,
+                                  tx_level=self.pod.radio_tx_level,
+                                  listen_tuning=self.pod.radio_listen_tuning,
+                                  pod_id=self.pod_id)
 
         return self.radio
 
     def send_request(self, request, with_nonce=False, double_take=False,
                         expect_critical_follow_up=False,
-                        tx_power=TxPower.Normal):
+                        tx_power=None):
+
+        self._publish_progress(request)
+        self.response_status = None
 
         nonce_obj = self.get_nonce()
         if with_nonce:
             nonce_val = nonce_obj.getNext()
             request.set_nonce(nonce_val)
             self.pod.nonce_syncword = None
+            self._journal_nonce()
 
         response = self.get_radio().send_message_get_message(request, double_take=double_take,
                                                              expect_critical_follow_up=expect_critical_follow_up,
                                                              tx_power=tx_power)
-        response_parse(response, self.pod)
+        self._parse_response(response)
 
         if with_nonce and self.pod.nonce_syncword is not None:
             self.logger.info("Nonce resync requested")
@@ -92,25 +144,196 @@ class Pdm:
             nonce_val = nonce_obj.getNext()
             request.set_nonce(nonce_val)
             self.pod.nonce_syncword = None
+            self._journal_nonce()
             self.get_radio().message_sequence = request.sequence
             response = self.get_radio().send_message_get_message(request, double_take=double_take,
                                                                  expect_critical_follow_up=expect_critical_follow_up)
-            response_parse(response, self.pod)
+            self._parse_response(response)
             if self.pod.nonce_syncword is not None:
                 self.get_nonce().reset()
+                self._journal_nonce()
                 raise PdmError("Nonce sync failed")
 
-    def _internal_update_status(self, update_type=0):
+    def _begin_command(self, command):
+        self.pod.last_command = command
+        self.command_started = time.time()
+
+    def _record_command(self):
+        if self.command_started is None or self.pod.last_command is None:
+            return
+
+        if self.pod.last_command["success"]:
+            result = "success"
+        else:
+            result = "failure"
+        get_metrics().histogram("omnipy_command_seconds", "Duration of pdm commands",
+                                command=self.pod.last_command["command"], result=result)\
+            .observe(time.time() - self.command_started)
+        self.command_started = None
+
+    def _parse_response(self, response):
+        self.response_status = None
+        response_parse(response, self.pod)
+        if self.journal is not None:
+            self.journal.set_pod_id(self.pod.id_lot, self.pod.id_t)
+        if self.radio is not None and \
+                any(response_type == PodResponse.Status for response_type, _ in response.get_parts()):
+            self.response_status = (time.time(), self.radio, self.radio.message_sequence)
+        self.pod.state_version += 1
+        if self.in_batch:
+            self.batch_status_time = time.time()
+        get_event_stream().publish("status", copy.deepcopy(self.pod.as_dict()), self.pod_id)
+
+    def _publish_progress(self, request):
+        command = None
+        if self.pod.last_command is not None:
+            command = self.pod.last_command.get("command")
+        get_event_stream().publish("progress", {"command": command,
+                                                "request": "%02x" % request.parts[0][0]}, self.pod_id)
+
+    def _journal_nonce(self):
+        if self.journal is not None and self.nonce is not None:
+            self.journal.set_nonce(self.nonce.lastNonce, self.nonce.seed)
+
+    def _replay_journal(self):
+        record = self.journal.replay()
+        if record is None or record["radio_address"] != self.pod.radio_address:
+            return
+        if record["id_lot"] != self.pod.id_lot or record["id_t"] != self.pod.id_t:
+            self.logger.info("Ignoring sequence journal written for another pod")
+            return
+
+        self.logger.info("Restoring radio sequences and nonce state from journal")
+        self.pod.radio_message_sequence = record["message_sequence"]
+        self.pod.radio_packet_sequence = record["packet_sequence"]
+        if record["nonce_last"] is not None:
+            self.pod.nonce_last = record["nonce_last"]
+            self.pod.nonce_seed = record["nonce_seed"]
+
+    def _internal_update_status(self, update_type=0, allow_piggyback=False):
         self._assert_pod_address_assigned()
+        if update_type == 0 and allow_piggyback and self._is_response_status_fresh():
+            self.logger.debug("Using pod status received with the preceding response")
+            get_metrics().counter("omnipy_status_piggyback_total",
+                                  "Status requests skipped using the status of the preceding response").inc()
+            return
+        if update_type == 0 and self.in_batch and self.batch_status_time is not None \
+                and time.time() - self.batch_status_time < BATCH_STATUS_MAX_AGE:
+            self.logger.debug("Using pod status received earlier in this batch")
+            return
         self.send_request(request_status(update_type))
 
-    def update_status(self, update_type=0):
+    def execute_batch(self, steps):
+        operations = {"status": self.update_status,
+                      "ack": self.acknowledge_alerts,
+                      "silence": self.hf_silence_will_fall,
+                      "bolus": self.bolus,
+                      "cancelbolus": self.cancel_bolus,
+                      "settempbasal": self.set_temp_basal,
+                      "canceltempbasal": self.cancel_temp_basal,
+                      "setbasalschedule": self.set_basal_schedule}
+
+        for operation, args in steps:
+            if operation not in operations:
+                raise PdmError("Unknown batch operation: %s" % operation)
+
+        results = []
+        with PdmLock(lock=self.lock):
+            owner = False
+            try:
+                self.logger.info("Executing batch of %d operations" % len(steps))
+                self.in_batch = True
+                owner = True
+                self.batch_status_time = None
+                failed = False
+                for operation, args in steps:
+                    result = {"operation": operation, "success": False}
+                    results.append(result)
+                    if failed:
+                        result["skipped"] = True
+                        continue
+
+                    start = time.perf_counter()
+                    try:
+                        operations[operation](**args)
+                        result["success"] = True
+                    except OmnipyError as oe:
+                        result["error"] = oe.error_message
+                        failed = True
+                    finally:
+                        result["duration"] = time.perf_counter() - start
+            finally:
+                if owner:
+                    self.in_batch = False
+                    self.batch_status_time = None
+                    self._savePod(command_logged=True)
+        return results
+
+    def _is_response_status_fresh(self):
+        if not self.piggyback_status or self.response_status is None:
+            return False
+        received, radio, message_sequence = self.response_status
+        return radio is self.radio and radio.message_sequence == message_sequence \
+            and radio.radio_address == self.pod.radio_address \
+            and time.time() - received < STATUS_PIGGYBACK_MAX_AGE
+
+    def get_status_age(self, update_type=0):
+        if update_type == 0:
+            updated = self.pod.state_last_updated
+        else:
+            updated = self.status_times.get(update_type)
+        if updated is None:
+            return None
+        return time.time() - updated
+
+    def update_status(self, update_type=0, max_age=None):
+        if max_age is not None:
+            age = self.get_status_age(update_type)
+            if age is not None and age <= max_age:
+                self.logger.debug("Serving status type %d received %.1f seconds ago" % (update_type, age))
+                return
+
+        if self.in_batch:
+            self._update_status(update_type)
+            return
+
+        with self.flight_lock:
+            flight = self.status_flights.get(update_type)
+            leader = flight is None
+            if leader:
+                flight = StatusFlight()
+                self.status_flights[update_type] = flight
+
+        if not leader:
+            self.logger.debug("Joining status request type %d already in flight" % update_type)
+            if flight.done.wait(STATUS_FLIGHT_TIMEOUT):
+                if flight.error is not None:
+                    raise flight.error
+                return
+            self.logger.warning("Status request type %d in flight did not finish in time, requesting it again"
+                                % update_type)
+            self._update_status(update_type)
+            return
+
+        try:
+            self._update_status(update_type)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.flight_lock:
+                del self.status_flights[update_type]
+            flight.done.set()
+
+    def _update_status(self, update_type):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self.logger.info("Updating pod status, request type %d" % update_type)
-                self.pod.last_command = { "command": "STATUS", "type": update_type, "success": False }
-                self._internal_update_status(update_type)
+                self._begin_command({ "command": "STATUS", "type": update_type, "success": False })
+                self._assert_pod_address_assigned()
+                self.send_request(request_status(update_type))
                 self.pod.last_command["success"] = True
+                self.status_times[update_type] = time.time()
         except OmnipyError:
             raise
         except Exception as e:
@@ -120,9 +343,9 @@ class Pdm:
 
     def acknowledge_alerts(self, alert_mask):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self.logger.info("Acknowledging alerts with bitmask %d" % alert_mask)
-                self.pod.last_command = {"command": "ACK_ALERTS", "mask": alert_mask, "success": False}
+                self._begin_command({"command": "ACK_ALERTS", "mask": alert_mask, "success": False})
                 self._assert_pod_address_assigned()
                 self._internal_update_status()
                 self._assert_can_acknowledge_alerts()
@@ -144,7 +367,7 @@ class Pdm:
 
     # def configure_reservoir_alarm(self, iu_reservoir_level=None):
     #     try:
-    #         with PdmLock(0):
+    #         with PdmLock(0, lock=self.lock):
     #             if iu_reservoir_level is None:
     #                 request = request_clear_low_reservoir_alert()
     #             else:
@@ -158,7 +381,7 @@ class Pdm:
     #
     # def configure_pod_expiry_alarm(self, minutes_after_activation=None):
     #     try:
-    #         with PdmLock(0):
+    #         with PdmLock(0, lock=self.lock):
     #             if minutes_after_activation is None:
     #                 request = request_clear_pod_expiry_alert()
     #             else:
@@ -171,11 +394,11 @@ class Pdm:
     #         raise PdmError("Unexpected error") from e
     def hf_silence_will_fall(self):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self._internal_update_status()
                 if self.pod.state_alert > 0:
                     self.logger.info("Acknowledging alerts with bitmask %d" % self.pod.state_alert)
-                    self.pod.last_command = {"command": "ACK_ALERTS", "mask": self.pod.state_alert, "success": False}
+                    self._begin_command({"command": "ACK_ALERTS", "mask": self.pod.state_alert, "success": False})
                     request = request_acknowledge_alerts(self.pod.state_alert)
                     self.send_request(request, with_nonce=True)
                     self.pod.last_command = {"command": "ACK_ALERTS", "mask": self.pod.state_alert, "success": False}
@@ -213,7 +436,7 @@ class Pdm:
 
     def is_busy(self):
         try:
-            with PdmLock(0):
+            with PdmLock(0, lock=self.lock):
                 return self._is_bolus_running(no_live_check=True)
         except PdmBusyError:
             return True
@@ -224,11 +447,11 @@ class Pdm:
 
     def bolus(self, bolus_amount):
         try:
-            with PdmLock():
-                self.pod.last_command = {"command": "BOLUS", "units": bolus_amount, "success": False}
+            with PdmLock(lock=self.lock):
+                self._begin_command({"command": "BOLUS", "units": bolus_amount, "success": False})
 
                 self._assert_pod_address_assigned()
-                self._internal_update_status()
+                self._internal_update_status(allow_piggyback=True)
                 self._assert_can_generate_nonce()
                 self._assert_immediate_bolus_not_active()
                 self._assert_not_faulted()
@@ -266,9 +489,9 @@ class Pdm:
 
     def cancel_bolus(self):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self.logger.debug("Canceling bolus")
-                self.pod.last_command = {"command": "BOLUS_CANCEL", "canceled": 0, "success": False}
+                self._begin_command({"command": "BOLUS_CANCEL", "canceled": 0, "success": False})
                 self._assert_pod_address_assigned()
                 self._assert_can_generate_nonce()
                 self._assert_not_faulted()
@@ -296,11 +519,11 @@ class Pdm:
 
     def cancel_temp_basal(self):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self.logger.debug("Canceling temp basal")
-                self.pod.last_command = {"command": "TEMPBASAL_CANCEL", "success": False}
+                self._begin_command({"command": "TEMPBASAL_CANCEL", "success": False})
                 self._assert_pod_address_assigned()
-                self._internal_update_status()
+                self._internal_update_status(allow_piggyback=True)
                 self._assert_can_generate_nonce()
                 self._assert_immediate_bolus_not_active()
                 self._assert_not_faulted()
@@ -328,14 +551,14 @@ class Pdm:
 
     def set_temp_basal(self, basalRate, hours, confidenceReminder=False):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self.logger.debug("Setting temp basal %02.2fU/h for %02.1fh"% (float(basalRate), float(hours)))
-                self.pod.last_command = {"command": "TEMPBASAL",
-                                         "duration_hours": hours,
-                                         "hourly_rate": basalRate,
-                                         "success": False}
+                self._begin_command({"command": "TEMPBASAL",
+                                     "duration_hours": hours,
+                                     "hourly_rate": basalRate,
+                                     "success": False})
                 self._assert_pod_address_assigned()
-                self._internal_update_status()
+                self._internal_update_status(allow_piggyback=True)
                 self._assert_can_generate_nonce()
                 self._assert_immediate_bolus_not_active()
                 self._assert_not_faulted()
@@ -376,13 +599,13 @@ class Pdm:
 
     def set_basal_schedule(self, schedule):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self.logger.debug("Setting basal schedule: %s"% schedule)
-                self.pod.last_command = {"command": "BASALSCHEDULE",
-                                         "hourly_rates": schedule,
-                                         "success": False}
+                self._begin_command({"command": "BASALSCHEDULE",
+                                     "hourly_rates": schedule,
+                                     "success": False})
                 self._assert_pod_address_assigned()
-                self._internal_update_status()
+                self._internal_update_status(allow_piggyback=True)
                 self._assert_can_generate_nonce()
                 self._assert_immediate_bolus_not_active()
                 self._assert_not_faulted()
@@ -418,9 +641,9 @@ class Pdm:
 
     def deactivate_pod(self):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self.logger.debug("Deactivating pod")
-                self.pod.last_command = {"command": "DEACTIVATE", "success": False}
+                self._begin_command({"command": "DEACTIVATE", "success": False})
                 self._internal_update_status()
                 self._assert_can_deactivate()
 
@@ -439,12 +662,12 @@ class Pdm:
 
     def pair_pod(self, candidate_address, utc_offset):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self.logger.debug("Activating pod")
-                self.pod.last_command = {"command": "PAIR",
-                                         "address": candidate_address,
-                                         "utc_offset": utc_offset,
-                                         "success": False}
+                self._begin_command({"command": "PAIR",
+                                     "address": candidate_address,
+                                     "utc_offset": utc_offset,
+                                     "success": False})
 
                 if self.pod.state_progress > PodProgress.PairingSuccess:
                     raise PdmError("Pod is already paired")
@@ -464,7 +687,7 @@ class Pdm:
                     response = self.get_radio().send_message_get_message(request, message_address=0xffffffff,
                                                                          ack_address_override=candidate_address,
                                                                          tx_power=TxPower.Low)
-                    response_parse(response, self.pod)
+                    self._parse_response(response)
 
                     self._assert_pod_can_activate()
 
@@ -491,7 +714,7 @@ class Pdm:
                     response = self.get_radio().send_message_get_message(request, message_address=0xffffffff,
                                                                          ack_address_override=candidate_address,
                                                                          tx_power=TxPower.Low)
-                    response_parse(response, self.pod)
+                    self._parse_response(response)
                     self._assert_pod_paired()
 
                 self.pod.last_command["success"] = True
@@ -506,10 +729,10 @@ class Pdm:
 
     def activate_pod(self):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
                 self.logger.debug("Activating pod")
-                self.pod.last_command = {"command": "ACTIVATE",
-                                         "success": False}
+                self._begin_command({"command": "ACTIVATE",
+                                     "success": False})
 
                 if self.pod.state_progress > PodProgress.ReadyForInjection:
                     raise PdmError("Pod is already activated")
@@ -578,12 +801,12 @@ class Pdm:
 
     def inject_and_start(self, basal_schedule):
         try:
-            with PdmLock():
+            with PdmLock(lock=self.lock):
 
                 self.logger.debug("Starting pod")
-                self.pod.last_command = {"command": "START",
-                                         "hourly_rates": basal_schedule,
-                                         "success": False}
+                self._begin_command({"command": "START",
+                                     "hourly_rates": basal_schedule,
+                                     "success": False})
 
                 if self.pod.state_progress >= PodProgress.Running:
                     raise PdmError("Pod has passed the injection stage")
@@ -652,22 +875,41 @@ class Pdm:
         finally:
             self._savePod()
 
-    def _savePod(self):
+    def _savePod(self, command_logged=False):
+        self._record_command()
+        if self.in_batch:
+            self._log_command()
+            return
         try:
             radio = self.get_radio()
             if radio is not None:
                 self.pod.radio_message_sequence = radio.message_sequence
                 self.pod.radio_packet_sequence = radio.packet_sequence
+                self.pod.radio_tx_level = radio.tx_controller.get_level()
+                self.pod.radio_listen_tuning = radio.listen_tuner.get_state()
 
             nonce = self.get_nonce()
             if nonce is not None:
                 self.pod.nonce_last = nonce.lastNonce
                 self.pod.nonce_seed = nonce.seed
 
-            return self.pod.Save()
+            self.pod.Save(write_history=not command_logged)
+
+            if self.pod.last_command is not None and not command_logged:
+                get_event_stream().publish("command", copy.deepcopy(self.pod.last_command), self.pod_id)
+
+            if self.journal is not None and radio is not None:
+                self._journal_nonce()
+                self.journal.compact(radio.radio_address, radio.message_sequence, radio.packet_sequence)
         except Exception as e:
             raise PdmError("Pod status was not saved") from e
 
+    def _log_command(self):
+        if self.pod.last_command is None:
+            return
+        self.pod.last_command_db_id = self.pod.log()
+        get_event_stream().publish("command", copy.deepcopy(self.pod.last_command), self.pod_id)
+
     def _is_bolus_running(self, no_live_check=False):
         if self.pod.state_last_updated is not None and self.pod.state_bolus != BolusState.Immediate:
             return False
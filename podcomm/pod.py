@@ -3,76 +3,105 @@ import simplejson as json
 import time
 import sqlite3
 
+POD_SCHEMA_VERSION = 1
+
+POD_FIELDS = (
+    ("id_lot", None),
+    ("id_t", None),
+    ("id_version_pm", None),
+    ("id_version_pi", None),
+    ("id_version_unknown_byte", None),
+    ("id_version_unknown_7_bytes", None),
+
+    ("radio_address", None),
+    ("radio_packet_sequence", 0),
+    ("radio_message_sequence", 0),
+    ("radio_low_gain", None),
+    ("radio_rssi", None),
+    ("radio_tx_level", None),
+    ("radio_listen_tuning", None),
+
+    ("nonce_last", None),
+    ("nonce_seed", 0),
+    ("nonce_syncword", None),
+
+    ("state_last_updated", None),
+    ("state_version", 0),
+    ("state_progress", PodProgress.InitialState),
+    ("state_basal", BasalState.NotRunning),
+    ("state_bolus", BolusState.NotRunning),
+    ("state_alert", 0),
+    ("state_alerts", None),
+    ("state_active_minutes", 0),
+    ("state_faulted", False),
+
+    ("var_maximum_bolus", None),
+    ("var_maximum_temp_basal_rate", None),
+    ("var_alert_low_reservoir", None),
+    ("var_alert_replace_pod", None),
+    ("var_basal_schedule", None),
+    ("var_notify_bolus_start", None),
+    ("var_notify_bolus_cancel", None),
+    ("var_notify_temp_basal_set", None),
+    ("var_notify_temp_basal_cancel", None),
+    ("var_notify_basal_schedule_change", None),
+
+    ("fault_event", None),
+    ("fault_event_rel_time", None),
+    ("fault_table_access", None),
+    ("fault_insulin_state_table_corruption", None),
+    ("fault_internal_variables", None),
+    ("fault_immediate_bolus_in_progress", None),
+    ("fault_progress_before", None),
+    ("fault_progress_before_2", None),
+    ("fault_information_type2_last_word", None),
+
+    ("insulin_reservoir", 0),
+    ("insulin_delivered", 0),
+    ("insulin_canceled", 0),
+
+    ("var_utc_offset", None),
+    ("var_activation_date", None),
+    ("var_insertion_date", None),
+
+    ("path", None),
+    ("path_db", None),
+
+    ("last_command", None),
+    ("last_command_db_id", None),
+    ("last_enacted_temp_basal_start", None),
+    ("last_enacted_temp_basal_duration", None),
+    ("last_enacted_temp_basal_amount", None),
+    ("last_enacted_bolus_start", None),
+    ("last_enacted_bolus_amount", None),
+)
+
+# schema version -> function upgrading a loaded dictionary to the next version,
+# versions without an entry load unchanged (files without a version are version 0)
+POD_MIGRATIONS = {
+}
+
+
+def _migrate(d):
+    version = d.get("schema_version", 0)
+    while version < POD_SCHEMA_VERSION:
+        if version in POD_MIGRATIONS:
+            d = POD_MIGRATIONS[version](d)
+        version += 1
+    return d
+
+
 class Pod:
+    __slots__ = tuple(name for name, _ in POD_FIELDS)
+
     def __init__(self):
-        self.id_lot = None
-        self.id_t = None
-        self.id_version_pm = None
-        self.id_version_pi = None
-        self.id_version_unknown_byte = None
-        self.id_version_unknown_7_bytes = None
-
-        self.radio_address = None
-        self.radio_packet_sequence = 0
-        self.radio_message_sequence = 0
-        self.radio_low_gain = None
-        self.radio_rssi = None
-
-        self.nonce_last = None
-        self.nonce_seed = 0
-        self.nonce_syncword = None
-
-        self.state_last_updated = None
-        self.state_progress = PodProgress.InitialState
-        self.state_basal = BasalState.NotRunning
-        self.state_bolus = BolusState.NotRunning
-        self.state_alert = 0
-        self.state_alerts = None
-        self.state_active_minutes = 0
-        self.state_faulted = False
-
-        self.var_maximum_bolus = None
-        self.var_maximum_temp_basal_rate = None
-        self.var_alert_low_reservoir = None
-        self.var_alert_replace_pod = None
-        self.var_basal_schedule = None
-        self.var_notify_bolus_start = None
-        self.var_notify_bolus_cancel = None
-        self.var_notify_temp_basal_set = None
-        self.var_notify_temp_basal_cancel = None
-        self.var_notify_basal_schedule_change = None
-
-        self.fault_event = None
-        self.fault_event_rel_time = None
-        self.fault_table_access = None
-        self.fault_insulin_state_table_corruption = None
-        self.fault_internal_variables = None
-        self.fault_immediate_bolus_in_progress = None
-        self.fault_progress_before = None
-        self.fault_progress_before_2 = None
-        self.fault_information_type2_last_word = None
-
-        self.insulin_reservoir = 0
-        self.insulin_delivered = 0
-        self.insulin_canceled = 0
-
-        self.var_utc_offset = None
-        self.var_activation_date = None
-        self.var_insertion_date = None
-
-        self.path = None
-        self.path_db = None
-
-        self.last_command = None
-        self.last_command_db_id = None
-        self.last_enacted_temp_basal_start = None
-        self.last_enacted_temp_basal_duration = None
-        self.last_enacted_temp_basal_amount = None
-        self.last_enacted_bolus_start = None
-        self.last_enacted_bolus_amount = None
-
-
-    def Save(self, save_as = None):
+        for name, default in POD_FIELDS:
+            setattr(self, name, default)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name, _ in POD_FIELDS}
+
+    def Save(self, save_as = None, write_history=True):
         if save_as is not None:
             self.path = save_as + POD_FILE_SUFFIX
             self.path_db = save_as + POD_DB_SUFFIX
@@ -81,14 +110,19 @@ class Pod:
             self.path = POD_FILE + POD_FILE_SUFFIX
             self.path_db = POD_FILE + POD_DB_SUFFIX
 
-        try:
-            self.last_command_db_id = self.log()
-        except:
-            pass
+        self.state_version += 1
+
+        if write_history:
+            try:
+                self.last_command_db_id = self.log()
+            except:
+                pass
 
         try:
+            d = self.as_dict()
+            d["schema_version"] = POD_SCHEMA_VERSION
             with open(self.path, "w") as stream:
-                json.dump(self.__dict__, stream, indent=4, sort_keys=True)
+                json.dump(d, stream, indent=4, sort_keys=True)
         except:
             pass
 
@@ -99,72 +133,14 @@ class Pod:
             db_path = POD_FILE + POD_DB_SUFFIX
 
         with open(path, "r") as stream:
-            d = json.load(stream)
-            p = Pod()
-            p.path = path
-            p.path_db = db_path
-
-            p.id_lot = d.get("id_lot", None)
-            p.id_t = d.get("id_t", None)
-            p.id_version_pm = d.get("id_version_pm", None)
-            p.id_version_pi = d.get("id_version_pi", None)
-            p.id_version_unknown_byte = d.get("id_version_unknown_byte", None)
-            p.id_version_unknown_7_bytes = d.get("id_version_unknown_7_bytes", None)
-
-            p.radio_address = d.get("radio_address", None)
-            p.radio_packet_sequence = d.get("radio_packet_sequence", None)
-            p.radio_message_sequence = d.get("radio_message_sequence", None)
-            p.radio_low_gain = d.get("radio_low_gain", None)
-            p.radio_rssi = d.get("radio_rssi", None)
-
-            p.state_last_updated = d.get("state_last_updated", None)
-            p.state_progress = d.get("state_progress", None)
-            p.state_basal = d.get("state_basal", None)
-            p.state_bolus = d.get("state_bolus", None)
-            p.state_alert = d.get("state_alert", None)
-            p.state_active_minutes = d.get("state_active_minutes", None)
-            p.state_faulted = d.get("state_faulted", None)
-
-            p.fault_event = d.get("fault_event", None)
-            p.fault_event_rel_time = d.get("fault_event_rel_time", None)
-            p.fault_table_access = d.get("fault_table_access", None)
-            p.fault_insulin_state_table_corruption = d.get("fault_insulin_state_table_corruption", None)
-            p.fault_internal_variables = d.get("fault_internal_variables", None)
-            p.fault_immediate_bolus_in_progress = d.get("fault_immediate_bolus_in_progress", None)
-            p.fault_progress_before = d.get("fault_progress_before", None)
-            p.fault_progress_before_2 = d.get("fault_progress_before_2", None)
-            p.fault_information_type2_last_word = d.get("fault_information_type2_last_word", None)
-
-            p.insulin_delivered = d.get("insulin_delivered", None)
-            p.insulin_canceled = d.get("insulin_canceled", None)
-            p.insulin_reservoir = d.get("insulin_reservoir", None)
-
-            p.nonce_last = d.get("nonce_last", None)
-            p.nonce_seed = d.get("nonce_seed", None)
-            p.nonce_syncword = d.get("nonce_syncword", None)
-
-            p.last_command = d.get("last_command", None)
-            p.last_enacted_temp_basal_start = d.get("last_enacted_temp_basal_start", None)
-            p.last_enacted_temp_basal_duration = d.get("last_enacted_temp_basal_duration", None)
-            p.last_enacted_temp_basal_amount = d.get("last_enacted_temp_basal_amount", None)
-            p.last_enacted_bolus_start = d.get("last_enacted_bolus_start", None)
-            p.last_enacted_bolus_amount = d.get("last_enacted_bolus_amount", None)
-
-            p.var_utc_offset = d.get("var_utc_offset", None)
-            p.var_activation_date = d.get("var_activation_date", None)
-            p.var_insertion_date = d.get("var_insertion_date", None)
-            p.var_basal_schedule = d.get("var_basal_schedule", None)
-            p.var_maximum_bolus = d.get("var_maximum_bolus", None)
-            p.var_maximum_temp_basal_rate = d.get("var_maximum_temp_basal_rate", None)
-            p.var_alert_low_reservoir = d.get("var_alert_low_reservoir", None)
-            p.var_alert_replace_pod = d.get("var_alert_replace_pod", None)
-
-            p.var_notify_bolus_start = d.get("var_notify_bolus_start", None)
-            p.var_notify_bolus_cancel = d.get("var_notify_bolus_cancel", None)
-            p.var_notify_temp_basal_set = d.get("var_notify_temp_basal_set", None)
-            p.var_notify_temp_basal_cancel = d.get("var_notify_temp_basal_cancel", None)
-            p.var_notify_basal_schedule_change = d.get("var_notify_basal_schedule_change", None)
+            d = _migrate(json.load(stream))
+
+        p = Pod()
+        for name, default in POD_FIELDS:
+            setattr(p, name, d.get(name, default))
 
+        p.path = path
+        p.path_db = db_path
         return p
 
     def is_active(self):
@@ -174,7 +150,7 @@ class Pod:
 
 
     def __str__(self):
-        return json.dumps(self.__dict__, indent=4, sort_keys=True)
+        return json.dumps(self.as_dict(), indent=4, sort_keys=True)
 
     def _get_conn(self):
         return sqlite3.connect(self.path_db)
@@ -8,6 +8,7 @@ from enum import IntEnum
 from threading import Event
 from .exceptions import PacketRadioError
 from .manchester import ManchesterCodec
+from .metrics import get_metrics
 
 from bluepy.btle import Peripheral, Scanner, BTLEException
 
@@ -81,19 +82,16 @@ class Encoding(IntEnum):
 
 PA_LEVELS = [0x12, 0x0E, 0x1D, 0x34, 0x2C, 0x60, 0x84, 0xC8, 0xC0]
 
-g_rl_address = None
-g_rl_version = None
-g_rl_v_major = None
-g_rl_v_minor = None
+g_rl_versions = {}
 
 class RileyLink(PacketRadio):
-    def __init__(self):
+    def __init__(self, address=None):
         self.peripheral = None
         self.pa_level_index = PA_LEVELS.index(0x84)
         self.data_handle = None
         self.logger = getLogger()
         self.packet_logger = get_packet_logger()
-        self.address = g_rl_address
+        self.address = address
         self.service = None
         self.response_handle = None
         self.notify_event = Event()
@@ -185,17 +183,15 @@ class RileyLink(PacketRadio):
             self.disconnect()
 
     def _read_version(self):
-        global g_rl_version, g_rl_v_major, g_rl_v_minor
         version = None
         try:
-            if g_rl_version is not None:
-                return g_rl_version, g_rl_v_major, g_rl_v_minor
+            if self.address in g_rl_versions:
+                return g_rl_versions[self.address]
             else:
                 response = self._command(Command.GET_VERSION)
                 if response is not None and len(response) > 0:
                     version = response.decode("ascii")
                     self.logger.debug("RL reports version string: %s" % version)
-                    g_rl_version = version
 
             if version is None:
                 return "0.0", 0, 0
@@ -205,11 +201,12 @@ class RileyLink(PacketRadio):
                 if m is None:
                     raise PacketRadioError("Failed to parse firmware version string: %s" % version)
 
-                g_rl_v_major = int(m.group(1))
-                g_rl_v_minor = int(m.group(2))
-                self.logger.debug("Interpreted version major: %d minor: %d" % (g_rl_v_major, g_rl_v_minor))
+                v_major = int(m.group(1))
+                v_minor = int(m.group(2))
+                self.logger.debug("Interpreted version major: %d minor: %d" % (v_major, v_minor))
 
-                return g_rl_version, g_rl_v_major, g_rl_v_minor
+                g_rl_versions[self.address] = version, v_major, v_minor
+                return version, v_major, v_minor
 
             except Exception as ex:
                 raise PacketRadioError("Failed to parse firmware version string: %s" % version) from ex
@@ -342,6 +339,15 @@ class RileyLink(PacketRadio):
         except Exception as e:
             raise PacketRadioError("Error while setting tx level") from e
 
+    def get_tx_level(self):
+        return self.pa_level_index
+
+    def set_tx_level(self, level):
+        try:
+            self._set_amp(min(len(PA_LEVELS) - 1, max(0, level)))
+        except Exception as e:
+            raise PacketRadioError("Error while setting tx level") from e
+
     def get_packet(self, timeout=5.0):
         try:
             self.connect()
@@ -396,29 +402,29 @@ class RileyLink(PacketRadio):
                     return
             self.connect()
             self._command(Command.UPDATE_REGISTER, bytes([Register.PATABLE0, PA_LEVELS[self.pa_level_index]]))
-            self.packet_logger.debug("Setting pa to %02X (%d of %d)" % (PA_LEVELS[self.pa_level_index], self.pa_level_index, len(PA_LEVELS)))
+            self.packet_logger.debug("Setting pa to %02X (%d of %d)", PA_LEVELS[self.pa_level_index], self.pa_level_index,
+                                    len(PA_LEVELS))
         except PacketRadioError:
             self.logger.exception("Error while setting tx amplification")
             raise
 
 
     def _findRileyLink(self):
-        global g_rl_address
         scanner = Scanner()
-        g_rl_address = None
+        address = None
         self.logger.debug("Scanning for RileyLink")
         retries = 10
-        while g_rl_address is None and retries > 0:
+        while address is None and retries > 0:
             retries -= 1
             for result in scanner.scan(1.0):
                 if result.getValueText(7) == RILEYLINK_SERVICE_UUID:
                     self.logger.debug("Found RileyLink")
-                    g_rl_address = result.addr
+                    address = result.addr
 
-        if g_rl_address is None:
+        if address is None:
             raise PacketRadioError("Could not find RileyLink")
 
-        return g_rl_address
+        return address
 
     def _connect_retry(self, retries):
         while retries > 0:
@@ -444,6 +450,8 @@ class RileyLink(PacketRadio):
                 time.sleep(1)
 
     def _command(self, command_type, command_data=None, timeout=10.0):
+        start = time.time()
+        result = "error"
         try:
             if command_data is None:
                 data = bytes([1, command_type])
@@ -461,11 +469,14 @@ class RileyLink(PacketRadio):
                 raise PacketRadioError("RileyLink returned no response")
             else:
                 if response[0] == Response.COMMAND_SUCCESS:
+                    result = "success"
                     return response[1:]
                 elif response[0] == Response.COMMAND_INTERRUPTED:
                     self.logger.warning("A previous command was interrupted")
+                    result = "interrupted"
                     return response[1:]
                 elif response[0] == Response.RX_TIMEOUT:
+                    result = "rx_timeout"
                     return None
                 else:
                     raise PacketRadioError("RileyLink returned error code: %02X. Additional response data: %s"
@@ -474,3 +485,7 @@ class RileyLink(PacketRadio):
             raise
         except Exception as e:
             raise PacketRadioError("Error executing command") from e
+        finally:
+            get_metrics().histogram("omnipy_ble_command_seconds", "Round trip of RileyLink BLE commands",
+                                    command=Command(command_type).name, result=result)\
+                .observe(time.time() - start)
@@ -2,8 +2,17 @@ from .exceptions import PacketRadioError, OmnipyTimeoutError
 from podcomm.packet_radio import TxPower
 from podcomm.protocol_common import *
 from .pr_rileylink import RileyLink
+from .capture import get_packet_capture
+from .metrics import get_metrics
+from .retry import create_retry_policy
+from .txpower import TxPowerController, rssi_to_dbm
+from .teardown import TeardownEstimator
+from .listentuner import ListenTuner
+from .radiopool import RadioPool
 from .definitions import *
-from threading import Thread, Event, RLock
+from threading import Thread, Event, RLock, Lock
+from concurrent.futures import Future, CancelledError
+from queue import Queue, Empty
 import binascii
 import time
 import subprocess
@@ -12,7 +21,39 @@ def _ack_data(address1, address2, sequence):
     return RadioPacket(address1, RadioPacketType.ACK, sequence,
                      struct.pack(">I", address2))
 
+EXCHANGE_COUNTERS = {
+    "unique_packets": "Unique packets sent and received",
+    "repeated_sends": "Packets sent again after no valid response",
+    "receive_timeouts": "Packet sends that received no response",
+    "repeated_receives": "Packets received again from the pod",
+    "protocol_errors": "Unexpected packet types or sequences received",
+    "bad_packets": "Packets that could not be parsed or had the wrong address",
+    "radio_errors": "Errors reported by the packet radio",
+}
+
+
+def _record_exchange(exchange):
+    if exchange.successful:
+        result = "success"
+    else:
+        result = "failure"
+
+    metrics = get_metrics()
+    metrics.counter("omnipy_radio_exchanges_total", "Radio message exchanges", result=result).inc()
+    metrics.histogram("omnipy_radio_exchange_seconds", "Duration of radio message exchanges",
+                      result=result).observe(exchange.ended - exchange.started)
+    metrics.histogram("omnipy_radio_queue_seconds", "Time from message request to start of the exchange")\
+        .observe(exchange.started - exchange.queued)
+    for name, help_text in EXCHANGE_COUNTERS.items():
+        value = getattr(exchange, name)
+        if value > 0:
+            metrics.counter("omnipy_radio_%s_total" % name, help_text).inc(value)
+
+
 class MessageExchange:
+    __slots__ = ("unique_packets", "repeated_sends", "receive_timeouts", "repeated_receives", "protocol_errors",
+                 "bad_packets", "radio_errors", "successful", "queued", "started", "ended", "rssi")
+
     def __init__(self):
         self.unique_packets = 0
         self.repeated_sends = 0
@@ -25,15 +66,90 @@ class MessageExchange:
         self.queued = 0
         self.started = 0
         self.ended = 0
+        self.rssi = None
+
+
+class RadioRequest:
+    def __init__(self, message, message_address, ack_address_override, tx_power, double_take,
+                 expect_critical_follow_up, deadline):
+        self.message = message
+        self.message_address = message_address
+        self.ack_address_override = ack_address_override
+        self.tx_power = tx_power
+        self.double_take = double_take
+        self.expect_critical_follow_up = expect_critical_follow_up
+        self.deadline = deadline
+        self.future = Future()
+        self.exchange = MessageExchange()
+        self.exchange.queued = time.time()
+
+
+class ExchangeStats:
+    def __init__(self, capacity=RADIO_STATS_CAPACITY):
+        self.capacity = capacity
+        self.exchanges = [None] * capacity
+        self.index = 0
+        self.total = 0
+        self.count = 0
+        self.successful = 0
+        self.duration_sum = 0.0
+        self.repeated_sends_sum = 0
+        self.rssi_sum = 0
+        self.rssi_count = 0
+        self.lock = Lock()
+
+    def add(self, exchange):
+        with self.lock:
+            oldest = self.exchanges[self.index]
+            if oldest is not None:
+                self._account(oldest, -1)
+            self.exchanges[self.index] = exchange
+            self._account(exchange, 1)
+            self.index = (self.index + 1) % self.capacity
+            self.total += 1
+
+    def _account(self, exchange, sign):
+        self.count += sign
+        if exchange.successful:
+            self.successful += sign
+        self.duration_sum += sign * (exchange.ended - exchange.started)
+        self.repeated_sends_sum += sign * exchange.repeated_sends
+        if exchange.rssi is not None:
+            self.rssi_sum += sign * rssi_to_dbm(exchange.rssi)
+            self.rssi_count += sign
+
+    def get_summary(self):
+        with self.lock:
+            durations = sorted(e.ended - e.started for e in self.exchanges if e is not None)
+            summary = {"total": self.total,
+                       "window": self.count,
+                       "success_rate": None,
+                       "duration_mean": None,
+                       "duration_p50": None,
+                       "duration_p90": None,
+                       "duration_p99": None,
+                       "retries_per_message": None,
+                       "rssi_mean": None}
+            if self.count > 0:
+                summary["success_rate"] = self.successful / self.count
+                summary["duration_mean"] = self.duration_sum / self.count
+                summary["retries_per_message"] = self.repeated_sends_sum / self.count
+                for p in [50, 90, 99]:
+                    summary["duration_p%d" % p] = durations[min(len(durations) - 1, len(durations) * p // 100)]
+            if self.rssi_count > 0:
+                summary["rssi_mean"] = self.rssi_sum / self.rssi_count
+            return summary
 
 class PdmRadio:
-    def __init__(self, radio_address, msg_sequence=0, pkt_sequence=0, packet_radio=None):
+    def __init__(self, radio_address, msg_sequence=0, pkt_sequence=0, packet_radio=None, journal=None,
+                 retry_policy=None, tx_level=None, listen_tuning=None, pod_id=None):
         self.radio_address = radio_address
         self.message_sequence = msg_sequence
         self.packet_sequence = pkt_sequence
         self.last_received_packet = None
         self.logger = getLogger()
         self.packet_logger = get_packet_logger()
+        self.capture = get_packet_capture(pod_id)
 
         if packet_radio is None:
             self.packet_radio = RileyLink()
@@ -42,81 +158,104 @@ class PdmRadio:
 
         self.last_packet_received = None
         self.last_packet_timestamp = None
+        self.journal = journal
 
-        self.request_arrived = Event()
-        self.response_received = Event()
+        if retry_policy is None:
+            self.retry_policy = create_retry_policy()
+        else:
+            self.retry_policy = retry_policy
+
+        self.tx_controller = TxPowerController(tx_level)
+        self.exchange_tx_level = None
+        self.listen_tuner = ListenTuner(listen_tuning)
+
+        self.requests = None
         self.request_shutdown = Event()
-        self.request_message = None
-        self.double_take = False
-        self.tx_power = None
-        self.expect_critical_follow_up = False
-        self.pod_message = None
-        self.response_exception = None
         self.radio_thread = None
-
-        self.pdm_message = None
-        self.pdm_message_address = None
         self.ack_address_override = None
 
-        self.stats = []
+        self.stats = ExchangeStats()
+        self.teardown = TeardownEstimator()
         self.current_exchange = MessageExchange()
         self.radio_lock = RLock()
         self.start()
 
     def start(self):
         with self.radio_lock:
-            self.radio_thread = Thread(target=self._radio_loop)
+            self.request_shutdown.clear()
+            self.requests = Queue()
+            self.radio_thread = Thread(target=self._radio_loop, args=(self.requests,))
             self.radio_thread.setDaemon(True)
             self._radio_init()
             self.radio_thread.start()
 
-    def stop(self):
+    def stop(self, timeout=RADIO_STOP_TIMEOUT):
         with self.radio_lock:
+            if self.radio_thread is None:
+                return
             self.request_shutdown.set()
-            self.request_arrived.set()
-            self.radio_thread.join()
+            self._cancel_queued()
+            self.requests.put(None)
+            self.radio_thread.join(timeout)
+            if self.radio_thread.is_alive():
+                self.logger.warning("Radio worker did not stop in %d seconds, disconnecting the radio", timeout)
+                self._disconnect()
+                self.radio_thread.join(timeout)
             self.radio_thread = None
-            self.request_shutdown.clear()
+
+    def submit_message(self, message,
+                       message_address=None,
+                       ack_address_override=None,
+                       tx_power=None, double_take=False,
+                       expect_critical_follow_up=False,
+                       deadline=None):
+        if message_address is None:
+            message_address = self.radio_address
+        request = RadioRequest(message, message_address, ack_address_override, tx_power, double_take,
+                               expect_critical_follow_up, deadline)
+        with self.radio_lock:
+            if self.radio_thread is None or self.request_shutdown.is_set():
+                raise PacketRadioError("Radio is stopped")
+            self.requests.put(request)
+        return request.future
 
     def send_message_get_message(self, message,
                                  message_address = None,
                                  ack_address_override=None,
                                  tx_power=None, double_take=False,
-                                 expect_critical_follow_up=False):
-        queued = time.time()
-        with self.radio_lock:
-            if self.radio_thread is None:
-                raise PacketRadioError("Radio is stopped")
-
-            self.pdm_message = message
-            if message_address is None:
-                self.pdm_message_address = self.radio_address
-            else:
-                self.pdm_message_address = message_address
-            self.ack_address_override = ack_address_override
-            self.pod_message = None
-            self.double_take = double_take
-            self.tx_power = tx_power
-            self.expect_critical_follow_up = expect_critical_follow_up
-
-            self.request_arrived.set()
-
-            self.response_received.wait()
-            self.response_received.clear()
-            self.current_exchange.queued = queued
+                                 expect_critical_follow_up=False,
+                                 deadline=None):
+        future = self.submit_message(message, message_address=message_address,
+                                     ack_address_override=ack_address_override,
+                                     tx_power=tx_power, double_take=double_take,
+                                     expect_critical_follow_up=expect_critical_follow_up,
+                                     deadline=deadline)
+        try:
+            return future.result()
+        except CancelledError:
+            raise PacketRadioError("Radio request was cancelled")
 
-            if self.pod_message is None:
-                self.current_exchange.successful = False
-                self.stats.append(self.current_exchange)
-                raise self.response_exception
+    def _cancel_queued(self):
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except Empty:
+                break
+            if request is not None:
+                request.future.cancel()
 
-            self.current_exchange.successful = True
-            self.stats.append(self.current_exchange)
-            return self.pod_message
+    def get_stats(self):
+        summary = self.stats.get_summary()
+        summary["teardown"] = self.teardown.get_summary()
+        summary["listen"] = self.listen_tuner.get_summary()
+        if isinstance(self.packet_radio, RadioPool):
+            summary["pool"] = self.packet_radio.get_summary()
+        return summary
 
     def get_packet(self, timeout=30000):
         with self.radio_lock:
             received = self.packet_radio.get_packet(timeout=timeout)
+            self.capture.received(received)
             p, rssi = self._get_packet(received)
             return p
 
@@ -130,43 +269,66 @@ class PdmRadio:
         except Exception:
             self.logger.exception("Error while disconnecting")
 
-    def _radio_loop(self):
+    def _radio_loop(self, requests):
         while True:
-            if not self.request_arrived.wait(timeout=5.0):
+            try:
+                request = requests.get(timeout=5.0)
+            except Empty:
                 self._disconnect()
-            self.request_arrived.wait()
-            self.request_arrived.clear()
+                request = requests.get()
 
-            if self.request_shutdown.wait(0):
+            if request is None or self.request_shutdown.is_set():
+                if request is not None:
+                    request.future.cancel()
                 self._disconnect()
+                if isinstance(self.packet_radio, RadioPool):
+                    self.packet_radio.disconnect_all()
                 break
 
-            self.current_exchange = MessageExchange()
-            self.current_exchange.started = time.time()
+            if not request.future.set_running_or_notify_cancel():
+                continue
 
-            try:
-                self.pod_message = self._send_and_get(self.pdm_message, self.pdm_message_address,
-                                                      self.ack_address_override,
-                                                      tx_power=self.tx_power, double_take=self.double_take,
-                                                      expect_critical_follow_up=self.expect_critical_follow_up)
-                self.response_exception = None
-            except Exception as e:
-                self.pod_message = None
-                self.response_exception = e
-
-            if self.response_exception is None:
-                ack_packet = self._final_ack(self.ack_address_override, self.packet_sequence)
-                self.current_exchange.ended = time.time()
-                self.response_received.set()
-                try:
-                    self._send_packet(ack_packet, allow_premature_exit_after=3.5)
-                except Exception:
-                    self.logger.exception("Error during ending conversation, ignored.")
+            if request.deadline is not None and time.time() > request.deadline:
+                request.future.set_exception(OmnipyTimeoutError("Radio request deadline passed while queued"))
+                continue
 
-            else:
-                self.current_exchange.ended = time.time()
-                self.response_received.set()
+            self._process_request(request)
+            self.capture.flush()
 
+    def _process_request(self, request):
+        self.current_exchange = request.exchange
+        self.current_exchange.started = time.time()
+        self.ack_address_override = request.ack_address_override
+
+        try:
+            pod_message = self._send_and_get(request.message, request.message_address,
+                                             request.ack_address_override,
+                                             tx_power=request.tx_power, double_take=request.double_take,
+                                             expect_critical_follow_up=request.expect_critical_follow_up)
+        except Exception as e:
+            self._end_exchange(False)
+            self._store_exchange()
+            request.future.set_exception(e)
+            return
+
+        ack_packet = self._final_ack(request.ack_address_override, self.packet_sequence)
+        self._end_exchange(True)
+        request.future.set_result(pod_message)
+        try:
+            self._send_packet(ack_packet, allow_premature_exit_after=self.teardown.get_preempt_after())
+        except Exception:
+            self.logger.exception("Error during ending conversation, ignored.")
+        self._store_exchange()
+
+    def _end_exchange(self, successful):
+        self.current_exchange.ended = time.time()
+        self.current_exchange.successful = successful
+
+    def _store_exchange(self):
+        self.stats.add(self.current_exchange)
+        self.retry_policy.record(self.current_exchange)
+        self.tx_controller.record(self.exchange_tx_level, self.current_exchange)
+        _record_exchange(self.current_exchange)
 
     def _interim_ack(self, ack_address_override, sequence):
         if ack_address_override is None:
@@ -210,6 +372,10 @@ class PdmRadio:
         self.packet_sequence = 0
         self.message_sequence = 0
 
+    def _journal_sequences(self):
+        if self.journal is not None:
+            self.journal.record(self.radio_address, self.message_sequence, self.packet_sequence)
+
     def _send_and_get(self, pdm_message, pdm_message_address, ack_address_override=None,
                       tx_power=None, double_take=False, expect_critical_follow_up=False):
 
@@ -223,6 +389,10 @@ class PdmRadio:
         try:
             if tx_power is not None:
                 self.packet_radio.set_tx_power(tx_power)
+                self.exchange_tx_level = None
+            else:
+                self.packet_radio.set_tx_level(self.tx_controller.get_level())
+                self.exchange_tx_level = self.packet_radio.get_tx_level()
         except PacketRadioError:
             if not self._radio_init(3):
                 raise
@@ -235,14 +405,14 @@ class PdmRadio:
         for part in range(0, packet_count):
             packet = packets[part]
             repeat_count = -1
-            timeout = 10
+            timeout = self.retry_policy.initial_timeout(part, packet_count)
             while True:
                 repeat_count += 1
                 if repeat_count == 0:
-                    self.logger.debug("Sending PDM message part %d/%d" % (part + 1, packet_count))
+                    self.logger.debug("Sending PDM message part %d/%d", part + 1, packet_count)
                 else:
-                    self.logger.debug("Sending PDM message part %d/%d (Repeat: %d)" %
-                                      (part + 1, packet_count, repeat_count))
+                    self.logger.debug("Sending PDM message part %d/%d (Repeat: %d)",
+                                      part + 1, packet_count, repeat_count)
 
                 if part == packet_count - 1:
                     expected_type = RadioPacketType.POD
@@ -250,89 +420,28 @@ class PdmRadio:
                     expected_type = RadioPacketType.ACK
 
                 try:
+                    self._journal_sequences()
                     received = self._exchange_packets(packet.with_sequence(self.packet_sequence),
                                                       expected_type=expected_type,
                                                       timeout=timeout)
                     break
                 except OmnipyTimeoutError:
                     self.logger.debug("Trying to recover from timeout error")
-                    if part == 0:
-                        if repeat_count == 0:
-                            timeout = 15
-                            continue
-                        elif repeat_count == 1:
-                            self._reset_sequences()
-                            timeout = 10
-                            time.sleep(2)
-                            continue
-                        elif repeat_count == 2:
-                            self._reset_sequences()
-                            self._radio_init()
-                            timeout = 15
-                            continue
-                        else:
-                            self.logger.debug("Failed recovery")
-                            if packet_count == 1:
-                                self.logger.debug("Calming pod down in case of reception problem on our end")
-                                ack_packet = self._final_ack(self.ack_address_override, 1)
-                                try:
-                                    self.packet_radio.set_tx_power(TxPower.Highest)
-                                    self._send_packet(ack_packet)
-                                except Exception:
-                                    self.logger.exception("Ignored.")
-                            self._reset_sequences()
-                            raise
-                    elif part < packet_count - 1:
-                        if repeat_count < 2:
-                            timeout = 20
-                            continue
-                        else:
-                            raise
-                    else:
-                        if repeat_count < 10:
-                            timeout = 20
-                            continue
-                        else:
-                            raise
+                    action = self.retry_policy.on_timeout(part, packet_count, repeat_count)
+                    if not self._recover(action):
+                        raise
+                    if action.timeout is not None:
+                        timeout = action.timeout
+                    continue
                 except PacketRadioError:
                     self.logger.debug("Trying to recover from radio error")
                     self.current_exchange.radio_errors += 1
-                    if part == 0:
-                        if repeat_count < 2:
-                            self._radio_init()
-                            continue
-                        elif repeat_count < 4:
-                            self._disconnect()
-                            self._kill_btle_subprocess()
-                            timeout = 10
-                            time.sleep(2)
-                            continue
-                        else:
-                            self.logger.debug("Failed recovery")
-                            self._reset_sequences()
-                            raise
-                    elif part < packet_count - 1:
-                        if repeat_count < 6:
-                            self._disconnect()
-                            self._kill_btle_subprocess()
-                            timeout = 10
-                            time.sleep(2)
-                            continue
-                        else:
-                            self.logger.debug("Failed recovery")
-                            self._reset_sequences()
-                            raise
-                    else:
-                        if repeat_count < 10:
-                            self._disconnect()
-                            self._kill_btle_subprocess()
-                            timeout = 10
-                            time.sleep(2)
-                            continue
-                        else:
-                            self.logger.debug("Failed recovery")
-                            self._reset_sequences()
-                            raise
+                    action = self.retry_policy.on_radio_error(part, packet_count, repeat_count)
+                    if not self._recover(action):
+                        raise
+                    if action.timeout is not None:
+                        timeout = action.timeout
+                    continue
                 except ProtocolError:
                     self.logger.debug("Trying to recover from protocol error")
                     self.packet_sequence = (received.sequence + 1) % 32
@@ -344,62 +453,107 @@ class PdmRadio:
             self.packet_sequence = (received.sequence + 1) % 32
 
 
-        self.packet_logger.info("SENT MSG %s" % pdm_message)
+        self.packet_logger.info("SENT MSG %s", pdm_message)
         part_count = 0
         if received.type == RadioPacketType.POD:
             part_count = 1
-            self.logger.debug("Received POD message part %d." % part_count)
+            self.logger.debug("Received POD message part %d.", part_count)
         pod_response = PodMessage()
         while not pod_response.add_radio_packet(received):
             ack_packet = self._interim_ack(ack_address_override, (received.sequence + 1) % 32)
             received = self._exchange_packets(ack_packet, RadioPacketType.CON)
             part_count += 1
-            self.logger.debug("Received POD message part %d." % part_count)
+            self.logger.debug("Received POD message part %d.", part_count)
 
-        self.packet_logger.info("RCVD MSG %s" % pod_response)
+        self.packet_logger.info("RCVD MSG %s", pod_response)
         self.logger.debug("Send and receive completed.")
         self.message_sequence = (pod_response.sequence + 1) % 16
         self.packet_sequence = (received.sequence + 1) % 32
+        self._journal_sequences()
         return pod_response
 
 
+    def _recover(self, action):
+        if self.request_shutdown.is_set():
+            self.logger.debug("Radio is stopping, abandoning recovery")
+            return False
+
+        if action.give_up:
+            self.logger.debug("Failed recovery")
+            if action.calm_pod:
+                self.logger.debug("Calming pod down in case of reception problem on our end")
+                ack_packet = self._final_ack(self.ack_address_override, 1)
+                try:
+                    self.packet_radio.set_tx_power(TxPower.Highest)
+                    self._send_packet(ack_packet)
+                except Exception:
+                    self.logger.exception("Ignored.")
+            if action.reset_sequences:
+                self._reset_sequences()
+            return False
+
+        if action.reset_sequences:
+            self._reset_sequences()
+        if action.restart_radio:
+            self._disconnect()
+            self._kill_btle_subprocess()
+        if action.reinit_radio:
+            self._radio_init()
+        if action.delay > 0:
+            time.sleep(action.delay)
+        return True
+
     def _exchange_packets(self, packet_to_send, expected_type, timeout=10):
         start_time = None
         first = True
+        tuning = None
         while start_time is None or time.time() - start_time < timeout:
+            if self.request_shutdown.is_set():
+                raise PacketRadioError("Radio is stopping")
+            regime = self.listen_tuner.get_regime(self.last_packet_timestamp, time.time())
             if first:
                 first = False
+                setting = self.listen_tuner.select(regime)
+                tuning = regime, setting
             else:
                 self.current_exchange.repeated_sends += 1
-            if self.last_packet_timestamp is None or time.time() - self.last_packet_timestamp > 4:
-                received = self.packet_radio.send_and_receive_packet(packet_to_send.get_data(), 0, 0, 300, 1, 300)
-            else:
-                received = self.packet_radio.send_and_receive_packet(packet_to_send.get_data(), 0, 0, 120, 0, 40)
+                setting = self.listen_tuner.get_default(regime)
+            data = packet_to_send.get_data()
+            sent = time.time()
+            received = self.packet_radio.send_and_receive_packet(data, 0, 0, *setting)
             if start_time is None:
                 start_time = time.time()
 
-            self.packet_logger.info("SEND PKT %s" % packet_to_send)
+            self.capture.sent(data)
+            self.capture.received(received)
+
+            self.packet_logger.info("SEND PKT %s", packet_to_send)
 
             if received is None:
+                tuning = self._record_listen(tuning, False, sent)
                 self.current_exchange.receive_timeouts += 1
                 self.packet_logger.debug("RECV PKT None")
                 self.packet_radio.tx_up()
                 continue
             p, rssi = self._get_packet(received)
             if p is None:
+                tuning = self._record_listen(tuning, False, sent)
                 self.current_exchange.bad_packets += 1
-                self.packet_logger.debug("RECV PKT BAD DATA: %s" % received.hex())
+                self.packet_logger.debug("RECV PKT BAD DATA: %s", received.hex())
                 self.packet_radio.tx_down()
                 continue
 
-            self.packet_logger.info("RECV PKT %s" % p)
+            self.packet_logger.info("RECV PKT %s", p)
             if p.address != self.radio_address:
+                tuning = self._record_listen(tuning, False, sent)
                 self.current_exchange.bad_packets += 1
                 self.packet_logger.debug("RECV PKT ADDR MISMATCH")
                 self.packet_radio.tx_down()
                 continue
 
+            tuning = self._record_listen(tuning, True, sent)
             self.last_packet_timestamp = time.time()
+            self.current_exchange.rssi = rssi
 
             if self.last_packet_received is not None and \
                         p.sequence == self.last_packet_received.sequence and \
@@ -413,13 +567,13 @@ class PdmRadio:
             self.packet_sequence = (p.sequence + 1) % 32
 
             if expected_type is not None and p.type != expected_type:
-                self.packet_logger.debug("RECV PKT unexpected type %s" % p)
+                self.packet_logger.debug("RECV PKT unexpected type %s", p)
                 self.current_exchange.protocol_errors += 1
                 raise ProtocolError("Unexpected packet type received")
 
             if p.sequence != (packet_to_send.sequence + 1) % 32:
                 self.packet_sequence = (p.sequence + 1) % 32
-                self.packet_logger.debug("RECV PKT unexpected sequence %s" % p)
+                self.packet_logger.debug("RECV PKT unexpected sequence %s", p)
                 self.last_packet_received = p
                 self.current_exchange.protocol_errors += 1
                 raise ProtocolError("Incorrect packet sequence received")
@@ -428,33 +582,58 @@ class PdmRadio:
 
         raise OmnipyTimeoutError("Exceeded timeout while send and receive")
 
+    def _record_listen(self, tuning, success, sent):
+        if tuning is not None:
+            regime, setting = tuning
+            self.listen_tuner.record(regime, setting, success, time.time() - sent)
+        return None
+
     def _send_packet(self, packet_to_send, timeout=25, allow_premature_exit_after=None):
         start_time = None
         self.current_exchange.unique_packets += 1
+        teardown = allow_premature_exit_after is not None
+        silence_timeout = 0.6
+        if teardown:
+            silence_timeout = self.teardown.get_silence_timeout()
+        first_send = None
+        repeats = 0
+        late_repeats = 0
+        last_repeat_after = 0
+        silent = False
         while start_time is None or time.time() - start_time < timeout:
             try:
-                self.packet_logger.info("SEND PKT %s" % packet_to_send)
+                self.packet_logger.info("SEND PKT %s", packet_to_send)
 
-                received = self.packet_radio.send_and_receive_packet(packet_to_send.get_data(), 0, 0, 300, 0, 40)
+                data = packet_to_send.get_data()
+                if first_send is None:
+                    first_send = time.time()
+                received = self.packet_radio.send_and_receive_packet(data, 0, 0, 300, 0, 40)
                 if start_time is None:
                     start_time = time.time()
-
-                if allow_premature_exit_after is not None and \
-                        time.time() - start_time >= allow_premature_exit_after:
-                    if self.request_arrived.wait(timeout=0):
+                self.capture.sent(data)
+                self.capture.received(received)
+
+                late = False
+                if teardown and not self.requests.empty():
+                    now = time.time()
+                    if (received is None and now - first_send >= allow_premature_exit_after) or \
+                            now - start_time >= RADIO_TEARDOWN_MAX_PREEMPT:
                         self.logger.debug("Prematurely exiting final phase to process next request")
                         self.packet_sequence = (self.packet_sequence + 1) % 32
                         break
                 if received is None:
-                    received = self.packet_radio.get_packet(0.6)
+                    received = self.packet_radio.get_packet(silence_timeout)
+                    self.capture.received(received)
                     if received is None:
                         self.packet_logger.debug("Silence")
                         self.packet_sequence = (self.packet_sequence + 1) % 32
+                        silent = True
                         break
+                    late = True
                 p, rssi = self._get_packet(received)
                 if p is None:
                     self.current_exchange.bad_packets += 1
-                    self.packet_logger.debug("RECV PKT bad %s" % received.hex())
+                    self.packet_logger.debug("RECV PKT bad %s", received.hex())
                     self.packet_radio.tx_down()
                     continue
 
@@ -469,11 +648,15 @@ class PdmRadio:
                     self.current_exchange.repeated_receives += 1
                     if p.type == self.last_packet_received.type and p.sequence == self.last_packet_received.sequence:
                         self.packet_logger.debug("RECV PKT previous")
+                        repeats += 1
+                        if late:
+                            late_repeats += 1
+                        last_repeat_after = self.last_packet_timestamp - first_send
                         self.packet_radio.tx_up()
                         continue
 
-                self.packet_logger.info("RECV PKT %s" % p)
-                self.packet_logger.debug("RECEIVED unexpected packet: %s" % p)
+                self.packet_logger.info("RECV PKT %s", p)
+                self.packet_logger.debug("RECEIVED unexpected packet: %s", p)
                 self.current_exchange.protocol_errors = 1
                 self.last_packet_received = p
                 self.packet_sequence = (p.sequence + 1) % 32
@@ -490,6 +673,10 @@ class PdmRadio:
                 start_time = time.time()
         else:
             self.logger.warning("Exceeded timeout while waiting for silence to fall")
+            return
+
+        if teardown and silent:
+            self.teardown.record(repeats, late_repeats, last_repeat_after)
 
     def _get_packet(self, data):
         rssi = None
@@ -0,0 +1,204 @@
+from .packet_radio import PacketRadio
+from .exceptions import PacketRadioError
+from .metrics import get_metrics
+from .definitions import *
+from collections import deque
+from threading import RLock, Thread
+import time
+
+
+class PooledRadio:
+    def __init__(self, radio, window=RADIO_POOL_WINDOW):
+        self.radio = radio
+        self.history = deque(maxlen=window)
+        self.connected = False
+        self.consecutive_errors = 0
+        self.connect_attempted = None
+
+    def record(self, latency, error):
+        self.history.append((latency, error))
+        if error:
+            self.consecutive_errors += 1
+        else:
+            self.consecutive_errors = 0
+
+    def get_score(self):
+        if not self.connected:
+            return None
+        if len(self.history) == 0:
+            return 0
+        error_rate = sum(1 for h in self.history if h[1]) / len(self.history)
+        latency = sum(h[0] for h in self.history) / len(self.history)
+        return latency + error_rate * RADIO_POOL_ERROR_PENALTY
+
+    def get_summary(self):
+        summary = {"address": getattr(self.radio, "address", None),
+                   "connected": self.connected,
+                   "commands": len(self.history),
+                   "error_rate": None,
+                   "latency_mean": None}
+        if len(self.history) > 0:
+            summary["error_rate"] = sum(1 for h in self.history if h[1]) / len(self.history)
+            summary["latency_mean"] = sum(h[0] for h in self.history) / len(self.history)
+        return summary
+
+
+class RadioPool(PacketRadio):
+    def __init__(self, radios):
+        if len(radios) == 0:
+            raise PacketRadioError("Radio pool needs at least one radio")
+        self.members = [PooledRadio(radio) for radio in radios]
+        self.active = self.members[0]
+        self.tx_power = None
+        self.tx_level = None
+        self.failovers = 0
+        self.closed = False
+        self.standby_thread = None
+        self.lock = RLock()
+        self.logger = getLogger()
+
+    def connect(self, force_initialize=False):
+        with self.lock:
+            self.closed = False
+            try:
+                self._call(self.active, "connect", force_initialize=force_initialize)
+                self.active.connected = True
+            except PacketRadioError:
+                if self.active.consecutive_errors < RADIO_POOL_FAILOVER_ERRORS or not self._failover():
+                    raise
+            self._start_standby_thread()
+
+    def disconnect(self, ignore_errors=True):
+        with self.lock:
+            self.active.connected = False
+            self.active.radio.disconnect(ignore_errors=ignore_errors)
+
+    def disconnect_all(self):
+        with self.lock:
+            self.closed = True
+            for member in self.members:
+                member.connected = False
+                try:
+                    member.radio.disconnect(ignore_errors=True)
+                except PacketRadioError:
+                    self.logger.exception("Error while disconnecting pooled radio")
+
+    def get_info(self):
+        return self._run("get_info")
+
+    def init_radio(self, force_init=False):
+        return self._run("init_radio", force_init=force_init)
+
+    def tx_up(self):
+        return self._run("tx_up")
+
+    def tx_down(self):
+        return self._run("tx_down")
+
+    def set_tx_power(self, tx_power):
+        self.tx_power = tx_power
+        self.tx_level = None
+        return self._run("set_tx_power", tx_power)
+
+    def get_tx_level(self):
+        return self.active.radio.get_tx_level()
+
+    def set_tx_level(self, level):
+        self.tx_level = level
+        self.tx_power = None
+        return self._run("set_tx_level", level)
+
+    def get_packet(self, timeout=5.0):
+        return self._run("get_packet", timeout=timeout)
+
+    def send_and_receive_packet(self, packet, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
+        return self._run("send_and_receive_packet", packet, repeat_count, delay_ms, timeout_ms, retry_count,
+                         preamble_ext_ms)
+
+    def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
+        return self._run("send_packet", packet, repeat_count, delay_ms, preamble_extension_ms)
+
+    def get_summary(self):
+        with self.lock:
+            members = []
+            for member in self.members:
+                summary = member.get_summary()
+                summary["active"] = member is self.active
+                members.append(summary)
+            return {"failovers": self.failovers, "radios": members}
+
+    def _run(self, method, *args, **kwargs):
+        with self.lock:
+            try:
+                return self._call(self.active, method, *args, **kwargs)
+            except PacketRadioError:
+                if self.active.consecutive_errors >= RADIO_POOL_FAILOVER_ERRORS:
+                    self._failover()
+                raise
+
+    def _call(self, member, method, *args, **kwargs):
+        start = time.time()
+        try:
+            result = getattr(member.radio, method)(*args, **kwargs)
+            member.record(time.time() - start, False)
+            return result
+        except PacketRadioError:
+            member.record(time.time() - start, True)
+            raise
+
+    def _start_standby_thread(self):
+        if self.standby_thread is not None and self.standby_thread.is_alive():
+            return
+        standbys = [m for m in self.members if m is not self.active and not m.connected]
+        if len(standbys) == 0:
+            return
+        self.standby_thread = Thread(target=self._connect_standbys, args=(standbys,), daemon=True)
+        self.standby_thread.start()
+
+    def _connect_standbys(self, standbys):
+        for member in standbys:
+            self._connect_standby(member)
+
+    def _connect_standby(self, member):
+        if member.connect_attempted is not None and \
+                time.time() - member.connect_attempted < RADIO_POOL_RECONNECT_INTERVAL:
+            return
+        member.connect_attempted = time.time()
+        try:
+            member.radio.connect(force_initialize=True)
+        except PacketRadioError:
+            self.logger.exception("Standby radio failed to connect")
+            return
+
+        with self.lock:
+            if not self.closed:
+                member.connected = True
+                member.consecutive_errors = 0
+                return
+        member.radio.disconnect(ignore_errors=True)
+
+    def _failover(self):
+        candidates = [m for m in self.members if m is not self.active and m.get_score() is not None]
+        if len(candidates) == 0:
+            self.logger.warning("No connected standby radio available for failover")
+            return False
+
+        standby = min(candidates, key=lambda m: m.get_score())
+        try:
+            if self.tx_level is not None:
+                standby.radio.set_tx_level(self.tx_level)
+            elif self.tx_power is not None:
+                standby.radio.set_tx_power(self.tx_power)
+        except PacketRadioError:
+            self.logger.exception("Standby radio failed to apply transmit power")
+            standby.record(0, True)
+            standby.connected = False
+            return False
+
+        self.logger.warning("Failing over to standby radio %s", getattr(standby.radio, "address", None))
+        self.active.connected = False
+        self.active.consecutive_errors = 0
+        self.active = standby
+        self.failovers += 1
+        get_metrics().counter("omnipy_radio_failovers_total", "Failovers to a standby radio").inc()
+        return True
@@ -0,0 +1,134 @@
+from .definitions import *
+from collections import deque
+import math
+
+
+class RetryAction:
+    def __init__(self, timeout=None, delay=0, reset_sequences=False, reinit_radio=False, restart_radio=False,
+                 give_up=False, calm_pod=False):
+        self.timeout = timeout
+        self.delay = delay
+        self.reset_sequences = reset_sequences
+        self.reinit_radio = reinit_radio
+        self.restart_radio = restart_radio
+        self.give_up = give_up
+        self.calm_pod = calm_pod
+
+
+class DefaultRetryPolicy:
+    def initial_timeout(self, part, packet_count):
+        return 10
+
+    def on_timeout(self, part, packet_count, repeat_count):
+        if part == 0:
+            if repeat_count == 0:
+                return RetryAction(timeout=15)
+            elif repeat_count == 1:
+                return RetryAction(timeout=10, delay=2, reset_sequences=True)
+            elif repeat_count == 2:
+                return RetryAction(timeout=15, reset_sequences=True, reinit_radio=True)
+            else:
+                return RetryAction(give_up=True, reset_sequences=True, calm_pod=packet_count == 1)
+        elif part < packet_count - 1:
+            if repeat_count < 2:
+                return RetryAction(timeout=20)
+            return RetryAction(give_up=True)
+        else:
+            if repeat_count < 10:
+                return RetryAction(timeout=20)
+            return RetryAction(give_up=True)
+
+    def on_radio_error(self, part, packet_count, repeat_count):
+        if part == 0:
+            if repeat_count < 2:
+                return RetryAction(reinit_radio=True)
+            elif repeat_count < 4:
+                return RetryAction(timeout=10, delay=2, restart_radio=True)
+        elif part < packet_count - 1:
+            if repeat_count < 6:
+                return RetryAction(timeout=10, delay=2, restart_radio=True)
+        else:
+            if repeat_count < 10:
+                return RetryAction(timeout=10, delay=2, restart_radio=True)
+        return RetryAction(give_up=True, reset_sequences=True)
+
+    def record(self, exchange):
+        pass
+
+
+class AdaptiveRetryPolicy(DefaultRetryPolicy):
+    def __init__(self, history=RETRY_HISTORY):
+        self.history = deque(maxlen=history)
+        self.recovering = False
+
+    def record(self, exchange):
+        self.history.append((exchange.ended - exchange.started,
+                             exchange.repeated_sends + 1,
+                             exchange.radio_errors,
+                             exchange.successful,
+                             exchange.successful and not self.recovering))
+        self.recovering = False
+
+    def _window(self):
+        # send time is measured on clean exchanges only, recoveries add delays and radio restarts,
+        # the response rate includes recovered and failed exchanges so that loss isn't underestimated
+        clean = [h for h in self.history if h[4]]
+        airlink = [h for h in self.history if h[2] == 0]
+        if len(clean) == 0 or len(airlink) < RETRY_MIN_HISTORY:
+            return None
+
+        send_time = sum(h[0] for h in clean) / sum(h[1] for h in clean)
+        success_rate = sum(1 for h in airlink if h[3]) / sum(h[1] for h in airlink)
+        if success_rate >= 1:
+            return send_time
+        if success_rate <= 0:
+            return None
+        # number of sends after which a response would have arrived with 1 - RETRY_MISS_PROBABILITY certainty
+        return send_time * math.log(RETRY_MISS_PROBABILITY) / math.log(1 - success_rate)
+
+    def _radio_error_rate(self):
+        if len(self.history) == 0:
+            return 0
+        return sum(1 for h in self.history if h[2] > 0) / len(self.history)
+
+    def _timeout(self, default, repeat_count):
+        window = self._window()
+        if window is None:
+            return default
+        timeout = window * (RETRY_TIMEOUT_GROWTH ** repeat_count)
+        return min(RETRY_MAX_TIMEOUT, max(RETRY_MIN_TIMEOUT, timeout))
+
+    def _delay(self, default, repeat_count):
+        if self._window() is None:
+            return default
+        return min(default, RETRY_MIN_DELAY * (2 ** repeat_count))
+
+    def initial_timeout(self, part, packet_count):
+        return self._timeout(DefaultRetryPolicy.initial_timeout(self, part, packet_count), 0)
+
+    def on_timeout(self, part, packet_count, repeat_count):
+        self.recovering = True
+        action = DefaultRetryPolicy.on_timeout(self, part, packet_count, repeat_count)
+        if not action.give_up:
+            action.timeout = self._timeout(action.timeout, repeat_count + 1)
+            action.delay = self._delay(action.delay, repeat_count)
+        return action
+
+    def on_radio_error(self, part, packet_count, repeat_count):
+        self.recovering = True
+        if repeat_count < 2 and self._radio_error_rate() >= RETRY_RADIO_ERROR_RATE:
+            # radio errors keep coming back after plain reinitializations, restart the radio straight away
+            action = RetryAction(restart_radio=True, delay=2)
+        else:
+            action = DefaultRetryPolicy.on_radio_error(self, part, packet_count, repeat_count)
+        if not action.give_up:
+            if action.timeout is not None:
+                action.timeout = self._timeout(action.timeout, repeat_count)
+            action.delay = self._delay(action.delay, repeat_count)
+        return action
+
+
+def create_retry_policy(name=RADIO_RETRY_POLICY):
+    if name == "adaptive":
+        return AdaptiveRetryPolicy()
+    return DefaultRetryPolicy()
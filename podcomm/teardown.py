@@ -0,0 +1,48 @@
+from .definitions import *
+from collections import deque
+import math
+
+
+class TeardownEstimator:
+    def __init__(self, window=RADIO_TEARDOWN_WINDOW):
+        self.history = deque(maxlen=window)
+        self.silence_requests = 0
+
+    def record(self, repeats, late_repeats, last_repeat_after):
+        self.history.append((repeats, late_repeats, last_repeat_after))
+
+    def get_preempt_after(self):
+        if len(self.history) < RADIO_TEARDOWN_MIN_SAMPLES:
+            return RADIO_TEARDOWN_MAX_PREEMPT
+
+        times = sorted(h[2] for h in self.history)
+        index = int(math.ceil(RADIO_TEARDOWN_QUANTILE * len(times))) - 1
+        preempt_after = times[index] + RADIO_TEARDOWN_MARGIN
+        return min(RADIO_TEARDOWN_MAX_PREEMPT, max(RADIO_TEARDOWN_MIN_PREEMPT, preempt_after))
+
+    def get_silence_timeout(self):
+        self.silence_requests += 1
+        if self.silence_requests % RADIO_TEARDOWN_PROBE_INTERVAL == 0:
+            return RADIO_TEARDOWN_MAX_SILENCE
+        return self._get_learned_silence_timeout()
+
+    def _get_learned_silence_timeout(self):
+        if len(self.history) < RADIO_TEARDOWN_MIN_SAMPLES:
+            return RADIO_TEARDOWN_MAX_SILENCE
+
+        for h in self.history:
+            if h[1] > 0:
+                return RADIO_TEARDOWN_MAX_SILENCE
+        return RADIO_TEARDOWN_MIN_SILENCE
+
+    def get_summary(self):
+        summary = {"samples": len(self.history),
+                   "repeats_mean": None,
+                   "repeats_max": None,
+                   "preempt_after": self.get_preempt_after(),
+                   "silence_timeout": self._get_learned_silence_timeout()}
+        if len(self.history) > 0:
+            repeats = [h[0] for h in self.history]
+            summary["repeats_mean"] = sum(repeats) / len(repeats)
+            summary["repeats_max"] = max(repeats)
+        return summary
@@ -0,0 +1,72 @@
+from .definitions import *
+from collections import deque
+import time
+
+
+def rssi_to_dbm(rssi):
+    if rssi >= 128:
+        rssi -= 256
+    return rssi / 2 - 74
+
+
+class TxPowerController:
+    def __init__(self, level=None, level_count=TX_POWER_LEVEL_COUNT, window=TX_POWER_WINDOW):
+        if level is None:
+            level = TX_POWER_DEFAULT_LEVEL
+        self.level = min(level_count - 1, max(0, level))
+        self.level_count = level_count
+        self.history = [deque(maxlen=window) for _ in range(level_count)]
+        self.logger = getLogger()
+
+    def get_level(self):
+        return self.level
+
+    def record(self, level, exchange):
+        if level is None or level < 0 or level >= self.level_count:
+            return
+
+        rssi = None
+        if exchange.rssi is not None:
+            rssi = rssi_to_dbm(exchange.rssi)
+        self.history[level].append((exchange.successful, exchange.repeated_sends, rssi, time.time()))
+
+        if level == self.level:
+            self._adjust()
+
+    def get_summary(self, level):
+        oldest = time.time() - TX_POWER_MAX_AGE
+        history = [h for h in self.history[level] if h[3] >= oldest]
+        if len(history) == 0:
+            return None
+        rssi = [h[2] for h in history if h[2] is not None]
+        summary = {"samples": len(history),
+                   "success_rate": sum(1 for h in history if h[0]) / len(history),
+                   "retries": sum(h[1] for h in history) / len(history),
+                   "rssi_dbm": None}
+        if len(rssi) > 0:
+            summary["rssi_dbm"] = sum(rssi) / len(rssi)
+        return summary
+
+    def _adjust(self):
+        current = self.get_summary(self.level)
+        if current is None or current["samples"] < TX_POWER_MIN_SAMPLES:
+            return
+
+        if current["success_rate"] < TX_POWER_MIN_SUCCESS_RATE or current["retries"] > TX_POWER_RAISE_RETRIES:
+            if self.level < self.level_count - 1:
+                self._set_level(self.level + 1)
+            return
+
+        if self.level > 0 and current["retries"] < TX_POWER_LOWER_RETRIES and current["rssi_dbm"] is not None \
+                and current["rssi_dbm"] >= TX_POWER_STRONG_RSSI:
+            lower = self.get_summary(self.level - 1)
+            if lower is None or lower["samples"] < TX_POWER_MIN_SAMPLES or \
+                    (lower["success_rate"] >= TX_POWER_MIN_SUCCESS_RATE and
+                     lower["retries"] <= TX_POWER_RAISE_RETRIES):
+                self._set_level(self.level - 1)
+
+    def _set_level(self, level):
+        self.logger.info("Starting transmit power level changed from %d to %d" % (self.level, level))
+        self.level = level
+        # start the new level's evaluation afresh so a single bad window does not bounce the level back
+        self.history[level].clear()
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+from podcomm.capture import read_capture, replay_capture, CAPTURE_SEND
+import argparse
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a binary packet capture")
+    parser.add_argument("path", type=str, help="Path to the packet capture file")
+    parser.add_argument("-p", "--packets", action="store_true", help="List raw packets instead of messages")
+    parser.add_argument("-b", "--benchmark", action="store_true", help="Only measure replay throughput")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        packet_count = 0
+        for _ in read_capture(args.path):
+            packet_count += 1
+        start = time.time()
+        message_count = 0
+        stats = {}
+        for _ in replay_capture(args.path, stats):
+            message_count += 1
+        elapsed = time.time() - start
+        print("%d packets (%d bad), %d messages replayed in %.3f s" % (packet_count, stats["bad_packets"],
+                                                                        message_count, elapsed))
+        return
+
+    if args.packets:
+        for timestamp, direction, rssi, data in read_capture(args.path):
+            print("%.3f %s %s %s" % (timestamp, "SEND" if direction == CAPTURE_SEND else "RECV",
+                                     "--" if rssi is None else "%02x" % rssi, data.hex()))
+    else:
+        stats = {}
+        for timestamp, direction, message in replay_capture(args.path, stats):
+            print("%.3f %s %s" % (timestamp, "SENT" if direction == CAPTURE_SEND else "RCVD", message))
+        if stats["bad_packets"] > 0:
+            print("%d packets could not be parsed" % stats["bad_packets"])
+
+
+if __name__ == '__main__':
+    main()
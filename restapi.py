@@ -1,30 +1,54 @@
 #!/usr/bin/python3
-from threading import Thread
+from threading import Thread, Condition, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 import signal
+import socket
+import selectors
+import copy
 import base64
+import hashlib
+import hmac
+import gzip
+import zlib
+from collections import OrderedDict
 from uuid import getnode as get_mac
 from decimal import *
 from threading import Lock
 from Crypto.Cipher import AES
 import simplejson as json
-from flask import Flask, request, send_from_directory
+from flask import Flask, Response, request, send_from_directory, stream_with_context, g, has_request_context
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
 from datetime import datetime
 import time
 from podcomm.pdm import Pdm, PdmLock
-from podcomm.pod import Pod
+from podcomm.manager import get_manager
+from podcomm.pod import Pod, POD_FIELDS
 from podcomm.pr_rileylink import RileyLink
+from podcomm.capture import get_packet_capture, close_packet_captures
+from podcomm.journal import SequenceJournal, get_journal_path
+from podcomm.logstore import set_log_pod_id
+from podcomm.events import get_event_stream
+from podcomm.clocksync import ClockSync
+from podcomm.metrics import get_metrics
 from podcomm.definitions import *
-from logging import FileHandler
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPE = "application/msgpack"
 
 
-g_oldest_diff = None
-g_time_diffs = []
 g_key = None
 g_pod = None
 g_pdm = None
 g_deny = False
-g_tokens = []
 g_token_lock = Lock()
+g_server = None
+g_rileylink = None
+g_clock = ClockSync()
 
 app = Flask(__name__, static_url_path="/")
 configureLogging()
@@ -39,6 +63,218 @@ class RestApiException(Exception):
     def __str__(self):
         return self.error_message
 
+
+class KeepAliveServerHandler(ServerHandler):
+    http_version = "1.1"
+
+    def __init__(self, request_handler, *args, **kwargs):
+        ServerHandler.__init__(self, *args, **kwargs)
+        self.request_handler = request_handler
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+        if "Content-Length" not in self.headers:
+            self.request_handler.close_connection = True
+        if self.request_handler.close_connection:
+            self.headers["Connection"] = "close"
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = REST_API_KEEPALIVE_TIMEOUT
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.parked = False
+        self.close_connection = True
+        self.handle_one_request()
+        self._handle_buffered_requests()
+        if not self.close_connection:
+            self.parked = self.server.park(self)
+
+    def resume(self):
+        self.parked = False
+        try:
+            self.handle_one_request()
+            self._handle_buffered_requests()
+        except Exception:
+            self.close_connection = True
+            self.server.handle_error(self.connection, self.client_address)
+        if not self.close_connection:
+            self.parked = self.server.park(self)
+        if not self.parked:
+            self.close()
+
+    def _handle_buffered_requests(self):
+        # pipelined requests already read into rfile will not wake the selector
+        while not self.close_connection and self._has_buffered_input():
+            self.handle_one_request()
+
+    def _has_buffered_input(self):
+        self.connection.settimeout(0)
+        try:
+            return len(self.rfile.peek(1)) > 0
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def finish(self):
+        if self.parked:
+            self.wfile.flush()
+        else:
+            WSGIRequestHandler.finish(self)
+
+    def close(self):
+        try:
+            WSGIRequestHandler.finish(self)
+        except OSError:
+            pass
+        self.server.shutdown_request(self.connection)
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except (socket.timeout, ConnectionError):
+            self.close_connection = True
+            return
+
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ""
+            self.request_version = ""
+            self.command = ""
+            self.send_error(414)
+            self.close_connection = True
+            return
+
+        if not self.parse_request():
+            return
+
+        if self.headers.get("Content-Length", "0") != "0" or "Transfer-Encoding" in self.headers:
+            self.close_connection = True
+
+        handler = KeepAliveServerHandler(self, self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+                                         multithread=True)
+        handler.run(self.server.get_app())
+
+    def log_message(self, format, *args):
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+
+class PooledWSGIServer(WSGIServer):
+    def __init__(self, host, port, wsgi_app, workers=REST_API_WORKERS, streams=REST_API_STREAMS):
+        WSGIServer.__init__(self, (host, port), KeepAliveRequestHandler)
+        self.set_app(wsgi_app)
+        self.executor = ThreadPoolExecutor(max_workers=workers + streams)
+        self.stream_slots = BoundedSemaphore(streams)
+        self.pending = 0
+        self.pending_condition = Condition()
+        self.draining = False
+        self.selector = selectors.DefaultSelector()
+        self.wake_socket, self.wake_socket_write = socket.socketpair()
+        self.wake_socket.setblocking(False)
+        self.selector.register(self.wake_socket, selectors.EVENT_READ)
+        self.selector_thread = Thread(target=self._selector_loop, daemon=True)
+        self.selector_thread.start()
+
+    def acquire_stream(self):
+        return self.stream_slots.acquire(blocking=False)
+
+    def release_stream(self):
+        self.stream_slots.release()
+
+    def park(self, handler):
+        with self.pending_condition:
+            if self.draining:
+                return False
+            self.selector.register(handler.connection, selectors.EVENT_READ,
+                                   (handler, time.time() + REST_API_KEEPALIVE_TIMEOUT))
+        self._wake()
+        return True
+
+    def _wake(self):
+        try:
+            self.wake_socket_write.send(b"\0")
+        except OSError:
+            pass
+
+    def _selector_loop(self):
+        while True:
+            ready = self.selector.select(timeout=1)
+            with self.pending_condition:
+                if self.draining:
+                    break
+                for key, events in ready:
+                    if key.fileobj is self.wake_socket:
+                        try:
+                            while self.wake_socket.recv(64):
+                                pass
+                        except OSError:
+                            pass
+                        continue
+                    self.selector.unregister(key.fileobj)
+                    self.pending += 1
+                    self.executor.submit(self._resume_worker, key.data[0])
+
+                now = time.time()
+                expired = [key for key in self.selector.get_map().values()
+                           if key.data is not None and key.data[1] < now]
+                for key in expired:
+                    self.selector.unregister(key.fileobj)
+            for key in expired:
+                key.data[0].close()
+
+    def process_request(self, request_socket, client_address):
+        with self.pending_condition:
+            self.pending += 1
+        self.executor.submit(self._process_request_worker, request_socket, client_address)
+
+    def _process_request_worker(self, request_socket, client_address):
+        handler = None
+        try:
+            handler = self.RequestHandlerClass(request_socket, client_address, self)
+        except Exception:
+            self.handle_error(request_socket, client_address)
+        finally:
+            if handler is None or not handler.parked:
+                self.shutdown_request(request_socket)
+            self._request_done()
+
+    def _resume_worker(self, handler):
+        try:
+            handler.resume()
+        finally:
+            self._request_done()
+
+    def _request_done(self):
+        with self.pending_condition:
+            self.pending -= 1
+            self.pending_condition.notify_all()
+
+    def drain(self, timeout=REST_API_DRAIN_TIMEOUT):
+        self.shutdown()
+        with self.pending_condition:
+            self.draining = True
+            parked = [key.data[0] for key in self.selector.get_map().values() if key.data is not None]
+            for handler in parked:
+                self.selector.unregister(handler.connection)
+        self._wake()
+        for handler in parked:
+            handler.close()
+        with self.pending_condition:
+            if not self.pending_condition.wait_for(lambda: self.pending == 0, timeout=timeout):
+                logger.warning("%d requests still pending after drain timeout", self.pending)
+        self.selector_thread.join(timeout=2)
+        self.executor.shutdown(wait=False)
+        self.selector.close()
+        self.wake_socket.close()
+        self.wake_socket_write.close()
+        self.server_close()
+
 def _set_pod(pod):
     global g_pod
     global g_pdm
@@ -50,12 +286,32 @@ def _set_pod(pod):
     g_pod.Save()
 
     if g_pdm is not None:
-        g_pdm.stop_radio()
+        g_pdm.close()
         g_pdm = None
 
 
+def _update_log_pod_id(pod):
+    if pod.id_lot is not None and pod.id_t is not None:
+        set_log_pod_id("%d-%d" % (pod.id_lot, pod.id_t))
+    else:
+        set_log_pod_id(None)
+
+
+def _requested_pod_id():
+    if has_request_context():
+        return request.args.get("pod")
+    return None
+
+
 def _get_pod():
     global g_pod
+    pod_id = _requested_pod_id()
+    if pod_id is not None:
+        try:
+            return get_manager().get_pdm(pod_id).pod
+        except:
+            logger.exception("Error while getting managed pod")
+            return None
     try:
         if g_pod is None:
             if os.path.exists(DATA_PATH + POD_FILE + POD_FILE_SUFFIX):
@@ -65,35 +321,77 @@ def _get_pod():
                 g_pod.path = DATA_PATH + POD_FILE + POD_FILE_SUFFIX
                 g_pod.path_db = DATA_PATH + POD_FILE + POD_DB_SUFFIX
                 g_pod.Save()
+        _update_log_pod_id(g_pod)
         return g_pod
     except:
         logger.exception("Error while loading pod")
         return None
 
 
+def _get_default_rileylink():
+    global g_rileylink
+    if g_rileylink is None:
+        g_rileylink = RileyLink()
+    return g_rileylink
+
+
 def _get_pdm():
     global g_pdm
+    pod_id = _requested_pod_id()
+    if pod_id is not None:
+        return get_manager().get_pdm(pod_id)
     try:
         if g_pdm is None:
-            g_pdm = Pdm(_get_pod())
+            g_pdm = Pdm(_get_pod(), packet_radio=_get_default_rileylink())
+            g_clock.apply(g_pdm)
         return g_pdm
     except:
         logger.exception("Error while creating pdm instance")
         return None
 
 
+def _get_all_pdms():
+    pdms = [get_manager().get_pdm(pod_id) for pod_id in get_manager().get_pod_ids()]
+    if g_pdm is not None:
+        pdms.append(g_pdm)
+    return pdms
+
+
+def _wait_until_idle(interval, timeout=REST_API_IDLE_TIMEOUT):
+    deadline = time.time() + timeout
+    for pdm in _get_all_pdms():
+        if pdm.pod.state_last_updated is None or pdm.radio is None:
+            continue
+        while pdm.is_busy():
+            if time.time() > deadline:
+                logger.warning("Pdm still busy after %d seconds, not waiting any longer" % timeout)
+                return
+            time.sleep(interval)
+
+
+def _assert_default_pod():
+    if _requested_pod_id() is not None:
+        raise RestApiException("Operation is not supported for managed pods")
+
+
+def _archive_requested_pod():
+    pod_id = _requested_pod_id()
+    if pod_id is not None:
+        return get_manager().archive_pod(pod_id)
+    archive_name = _archive_pod()
+    _set_pod(Pod())
+    return archive_name
+
+
 def _flush_handlers(logger):
-    for handler in logger.handlers:
-        if isinstance(handler, MemoryHandler):
-            handler.flush()
-        if isinstance(handler, FileHandler):
-            handler.flush()
-            handler.close()
+    flush_logger(logger, close=True)
 
 def _archive_pod():
     global g_pod
     global g_pdm
     try:
+        if g_pdm is not None:
+            g_pdm.close()
         g_pod = None
         g_pdm = None
         archive_name = None
@@ -106,17 +404,18 @@ def _archive_pod():
         if os.path.isfile(DATA_PATH + POD_FILE + POD_DB_SUFFIX):
             os.rename(DATA_PATH + POD_FILE + POD_DB_SUFFIX,
                       DATA_PATH + POD_FILE + archive_suffix + POD_DB_SUFFIX)
+        if os.path.isfile(DATA_PATH + POD_FILE + POD_JOURNAL_SUFFIX):
+            os.rename(DATA_PATH + POD_FILE + POD_JOURNAL_SUFFIX,
+                      DATA_PATH + POD_FILE + archive_suffix + POD_JOURNAL_SUFFIX)
 
-        _flush_handlers(getLogger())
-        _flush_handlers(get_packet_logger())
-
-        if os.path.isfile(DATA_PATH + OMNIPY_PACKET_LOGFILE + LOGFILE_SUFFIX):
-            os.rename(DATA_PATH + OMNIPY_PACKET_LOGFILE + LOGFILE_SUFFIX,
-                      DATA_PATH + OMNIPY_PACKET_LOGFILE + archive_suffix + LOGFILE_SUFFIX)
+        rotate_logger(getLogger())
+        rotate_logger(get_packet_logger())
+        set_log_pod_id(None)
+        get_packet_capture().close()
 
-        if os.path.isfile(DATA_PATH + OMNIPY_LOGFILE + LOGFILE_SUFFIX):
-            os.rename(DATA_PATH + OMNIPY_LOGFILE + LOGFILE_SUFFIX,
-                      DATA_PATH + OMNIPY_LOGFILE + archive_suffix + LOGFILE_SUFFIX)
+        if os.path.isfile(DATA_PATH + OMNIPY_PACKET_CAPTURE_FILE + PACKET_CAPTURE_SUFFIX):
+            os.rename(DATA_PATH + OMNIPY_PACKET_CAPTURE_FILE + PACKET_CAPTURE_SUFFIX,
+                      DATA_PATH + OMNIPY_PACKET_CAPTURE_FILE + archive_suffix + PACKET_CAPTURE_SUFFIX)
 
         return archive_name
     except:
@@ -151,25 +450,187 @@ def _save_activated_pod_address(addr):
         logger.exception("Error while storing activated radio address")
 
 
-def _create_response(success, response, pod_status=None):
+class TokenStore:
+    def __init__(self, ttl, capacity):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def _expire(self, now):
+        while len(self.entries) > 0:
+            key, (expires, _) = next(iter(self.entries.items()))
+            if expires > now:
+                break
+            self.entries.popitem(last=False)
+
+    def add(self, key, value=True):
+        now = time.time()
+        self._expire(now)
+        while len(self.entries) >= self.capacity:
+            self.entries.popitem(last=False)
+        self.entries[key] = (now + self.ttl, value)
+        return now + self.ttl
+
+    def get(self, key):
+        self._expire(time.time())
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def pop(self, key):
+        self._expire(time.time())
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def clear(self):
+        self.entries.clear()
+
+
+g_tokens = TokenStore(TOKEN_TTL, TOKEN_STORE_SIZE)
+g_sessions = TokenStore(SESSION_TTL, SESSION_STORE_SIZE)
+
+
+class ResponseEncoder:
+    def __init__(self):
+        self.separators = (",", ":")
+        self.api = json.dumps({"version_major": API_VERSION_MAJOR, "version_minor": API_VERSION_MINOR,
+                               "version_revision": API_VERSION_REVISION, "version_build": API_VERSION_BUILD},
+                              separators=self.separators, sort_keys=True)
+        self.status_keys = sorted([name for name, _ in POD_FIELDS])
+        self.status_snapshot = {}
+        self.lock = Lock()
+
+    def encode(self, success, response, pod_status, pretty=False):
+        if response is None:
+            response = {}
+        elif response.__class__ != dict:
+            response = response.__dict__
+
+        if pretty:
+            if pod_status is None:
+                pod_status = {}
+            elif pod_status.__class__ != dict:
+                pod_status = pod_status.as_dict()
+            return json.dumps({"success": success,
+                               "response": response,
+                               "status": pod_status,
+                               "datetime": time.time(),
+                               "api": json.loads(self.api)
+                               }, indent=4, sort_keys=True)
+
+        return '{"api":%s,"datetime":%s,"response":%s,"status":%s,"success":%s}' % (
+            self.api,
+            json.dumps(time.time()),
+            json.dumps(response, separators=self.separators, sort_keys=True),
+            self._encode_status(pod_status),
+            json.dumps(success))
+
+    def encode_binary(self, success, response, pod_status):
+        if response is None:
+            response = {}
+        elif response.__class__ != dict:
+            response = response.__dict__
+
+        if pod_status is None:
+            pod_status = {}
+        elif pod_status.__class__ != dict:
+            pod_status = pod_status.as_dict()
+
+        return msgpack.packb({"success": success,
+                              "response": response,
+                              "status": pod_status,
+                              "datetime": time.time(),
+                              "api": json.loads(self.api)
+                              }, default=self._binary_default)
+
+    def _binary_default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        raise TypeError("Cannot encode %s" % obj.__class__.__name__)
+
+    def _encode_status(self, pod_status):
+        if pod_status is None:
+            return "{}"
+        if pod_status.__class__ == dict:
+            return json.dumps(pod_status, separators=self.separators, sort_keys=True)
+
+        fragments = []
+        with self.lock:
+            for key in self.status_keys:
+                value = getattr(pod_status, key)
+                snapshot = self.status_snapshot.get(key)
+                if snapshot is None or snapshot[0].__class__ != value.__class__ or snapshot[0] != value:
+                    snapshot = (copy.deepcopy(value),
+                                '"%s":%s' % (key, json.dumps(value, separators=self.separators, sort_keys=True)))
+                    self.status_snapshot[key] = snapshot
+                fragments.append(snapshot[1])
+        return "{" + ",".join(fragments) + "}"
+
+
+g_encoder = ResponseEncoder()
+
+
+def _create_response(success, response, pod_status=None, pretty=False, binary=False):
+    if binary:
+        return app.response_class(g_encoder.encode_binary(success, response, pod_status),
+                                  mimetype=MSGPACK_MIMETYPE)
+    return g_encoder.encode(success, response, pod_status, pretty=pretty)
+
+
+def _binary_requested():
+    if msgpack is None:
+        return False
+    if request.args.get("format") == "msgpack":
+        return True
+    return request.accept_mimetypes.best == MSGPACK_MIMETYPE
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.time()
+
+
+@app.after_request
+def _record_request(response):
+    if request.url_rule is None:
+        handler = "unknown"
+    else:
+        handler = request.url_rule.rule
+    get_metrics().histogram("omnipy_http_request_seconds", "Duration of rest api requests",
+                            handler=handler, status=response.status_code)\
+        .observe(time.time() - g.request_started)
+    return response
+
 
-    if pod_status is None:
-        pod_status = {}
-    elif pod_status.__class__ != dict:
-        pod_status = pod_status.__dict__
+@app.after_request
+def _compress_response(response):
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200 \
+            or "Content-Encoding" in response.headers:
+        return response
 
-    if response is None:
-        response = {}
-    elif response.__class__ != dict:
-        response = response.__dict__
+    encoding = request.accept_encodings.best_match(["gzip", "deflate"])
+    if encoding is None:
+        return response
 
-    return json.dumps({"success": success,
-                       "response": response,
-                       "status": pod_status,
-                       "datetime": time.time(),
-                       "api": {"version_major": API_VERSION_MAJOR, "version_minor": API_VERSION_MINOR,
-                               "version_revision": API_VERSION_REVISION, "version_build": API_VERSION_BUILD}
-                       }, indent=4, sort_keys=True)
+    data = response.get_data()
+    if len(data) < REST_API_COMPRESS_MIN_BYTES:
+        return response
+
+    if encoding == "gzip":
+        data = gzip.compress(data, compresslevel=REST_API_COMPRESS_LEVEL)
+    else:
+        data = zlib.compress(data, REST_API_COMPRESS_LEVEL)
+
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag("%s-%s" % (etag, encoding), weak)
+    return response
 
 
 def _verify_auth(request_obj):
@@ -178,6 +639,10 @@ def _verify_auth(request_obj):
         if g_deny:
             raise RestApiException("Pdm is shutting down")
 
+        if request_obj.args.get("session") is not None:
+            _verify_session(request_obj)
+            return
+
         i = request_obj.args.get("i")
         a = request_obj.args.get("auth")
         if i is None or a is None:
@@ -190,9 +655,7 @@ def _verify_auth(request_obj):
         token = cipher.decrypt(auth)
 
         with g_token_lock:
-            if token in g_tokens:
-                g_tokens.remove(token)
-            else:
+            if g_tokens.pop(token) is None:
                 raise RestApiException("Invalid authentication token")
     except RestApiException:
         logger.exception("Authentication error")
@@ -202,46 +665,138 @@ def _verify_auth(request_obj):
         raise
 
 
-def _adjust_time(adjustment):
-    logger.info("Adjusting local time by %d ms" % adjustment)
-    pdm = _get_pdm()
-    if pdm is not None:
-        pdm.set_time_adjustment(adjustment / 1000)
+def _session_signature(session_key, session_id, seq):
+    return hmac.new(session_key, session_id + seq.to_bytes(4, "big"), hashlib.sha256).digest()
 
 
-def _api_result(result_lambda, generic_err_message):
-    global g_time_diffs, g_oldest_diff
+def _verify_session(request_obj):
+    session_id = base64.b64decode(request_obj.args.get("session"))
+    seq = request_obj.args.get("seq")
+    sig = request_obj.args.get("sig")
+    if seq is None or sig is None:
+        raise RestApiException("Authentication failed")
+    seq = int(seq)
+
+    with g_token_lock:
+        session = g_sessions.get(session_id)
+        if session is None:
+            raise RestApiException("Invalid session")
+
+        expected = _session_signature(session["key"], session_id, seq)
+        if seq <= session["seq"] or not hmac.compare_digest(expected, base64.b64decode(sig)):
+            raise RestApiException("Invalid session signature")
+
+        session["seq"] = seq
+        session["uses"] -= 1
+        if session["uses"] <= 0:
+            g_sessions.pop(session_id)
+
+
+def _stream_signature(session_key, session_id):
+    return hmac.new(session_key, session_id + b"events", hashlib.sha256).digest()
+
+
+def _verify_stream_auth(request_obj):
+    if request_obj.args.get("session") is None or request_obj.args.get("seq") is not None:
+        _verify_auth(request_obj)
+        return
+
     try:
         if g_deny:
             raise RestApiException("Pdm is shutting down")
 
-        if request.args.get('req_t') is not None:
-            req_time = int(request.args.get('req_t'))
-            local_time = int(time.time() * 1000)
-            difference_ms = (req_time - local_time)
-            if g_oldest_diff is None:
-                g_oldest_diff = local_time
-
-            if g_oldest_diff - local_time > 300:
-                g_time_diffs = [difference_ms]
-                g_oldest_diff = local_time
-            else:
-                g_time_diffs.append(difference_ms)
+        session_id = base64.b64decode(request_obj.args.get("session"))
+        sig = request_obj.args.get("sig")
+        if sig is None:
+            raise RestApiException("Authentication failed")
+
+        with g_token_lock:
+            session = g_sessions.get(session_id)
+            if session is None:
+                raise RestApiException("Invalid session")
+            expected = _stream_signature(session["key"], session_id)
+
+        if not hmac.compare_digest(expected, base64.b64decode(sig)):
+            raise RestApiException("Invalid session signature")
+    except RestApiException:
+        logger.exception("Authentication error")
+        raise
+    except Exception:
+        logger.exception("Error during verify_stream_auth")
+        raise
+
 
-            if len(g_time_diffs) > 3:
-                diff_avg = sum(g_time_diffs) / len(g_time_diffs)
-                g_time_diffs = []
+def _pretty_requested():
+    val = request.args.get("pretty")
+    return val is not None and (val == "1" or val.capitalize() == "TRUE")
 
-                if diff_avg > 30000 or diff_avg < -30000:
-                    _adjust_time(diff_avg)
 
-        return _create_response(True,
-                               response=result_lambda(), pod_status=_get_pod())
+NOT_MODIFIED = object()
+
+
+def _pod_etag(pod):
+    if pod is None:
+        return None
+    etag = "%s.%s.%d" % (pod.id_lot, pod.id_t, pod.state_version)
+    if _binary_requested():
+        etag += "-msgpack"
+    return etag
+
+
+def _matching_etag(etag):
+    for candidate in [etag, etag + "-gzip", etag + "-deflate"]:
+        if request.if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def _since_parameter():
+    since = request.args.get("since")
+    if since is None:
+        return None
+    try:
+        return int(since)
+    except ValueError:
+        return None
+
+
+def _api_result(result_lambda, generic_err_message, state_delta=True, conditional=False):
+    try:
+        if g_deny:
+            raise RestApiException("Pdm is shutting down")
+
+        if request.args.get('req_t') is not None:
+            g_clock.record(int(request.args.get('req_t')) - int(time.time() * 1000))
+
+        result = result_lambda()
+        pod = _get_pod()
+        etag = None
+        if conditional:
+            etag = _pod_etag(pod)
+        if result is NOT_MODIFIED:
+            response = app.response_class(status=304)
+            response.set_etag(_matching_etag(etag))
+            response.vary.update(["Accept", "Accept-Encoding"])
+            return response
+
+        since = _since_parameter()
+        pod_status = pod
+        if state_delta and since is not None and pod is not None and since == pod.state_version:
+            pod_status = None
+
+        response = app.make_response(_create_response(True, response=result, pod_status=pod_status,
+                                                      pretty=_pretty_requested(), binary=_binary_requested()))
+        if etag is not None:
+            response.set_etag(etag)
+        response.vary.update(["Accept", "Accept-Encoding"])
+        return response
     except RestApiException as rae:
-        return _create_response(False, response=rae, pod_status=_get_pod())
+        return _create_response(False, response=rae, pod_status=_get_pod(), pretty=_pretty_requested(),
+                                binary=_binary_requested())
     except Exception as e:
         logger.exception(generic_err_message)
-        return _create_response(False, response=e, pod_status=_get_pod())
+        return _create_response(False, response=e, pod_status=_get_pod(), pretty=_pretty_requested(),
+                                binary=_binary_requested())
 
 
 def _get_pdm_address(timeout):
@@ -263,9 +818,7 @@ def _get_pdm_address(timeout):
 
 def archive_pod():
     _verify_auth(request)
-    pod = Pod()
-    _archive_pod()
-    _set_pod(pod)
+    _archive_requested_pod()
 
 def ping():
     return {"pong": None}
@@ -274,16 +827,34 @@ def ping():
 def create_token():
     token = bytes(os.urandom(16))
     with g_token_lock:
-        g_tokens.append(token)
+        g_tokens.add(token)
     return {"token": base64.b64encode(token)}
 
 
+def create_session():
+    _verify_auth(request)
+    session_id = bytes(os.urandom(16))
+    session_key = hmac.new(g_key, session_id, hashlib.sha256).digest()
+    with g_token_lock:
+        expires = g_sessions.add(session_id, {"key": session_key, "seq": 0, "uses": SESSION_MAX_USES})
+    return {"session": base64.b64encode(session_id), "expires": expires, "uses": SESSION_MAX_USES}
+
+
+def get_metrics_text():
+    return Response(get_metrics().render(), mimetype="text/plain; version=0.0.4")
+
+
+def get_clock_info():
+    return g_clock.get_info(g_pdm)
+
+
 def check_password():
     _verify_auth(request)
 
 
 def get_pdm_address():
     _verify_auth(request)
+    _assert_default_pod()
 
     timeout = 30000
     if request.args.get('timeout') is not None:
@@ -298,6 +869,7 @@ def get_pdm_address():
 
 def new_pod():
     _verify_auth(request)
+    _assert_default_pod()
 
     pod = Pod()
 
@@ -322,9 +894,7 @@ def pair_pod():
 
     pod = _get_pod()
     if pod.state_progress >= PodProgress.Running:
-        pod = Pod()
-        _archive_pod()
-        _set_pod(pod)
+        _archive_requested_pod()
 
     pdm = _get_pdm()
 
@@ -357,14 +927,14 @@ def start_pod():
 
 def _int_parameter(obj, parameter):
     if request.args.get(parameter) is not None:
-        obj.__dict__[parameter] = int(request.args.get(parameter))
+        setattr(obj, parameter, int(request.args.get(parameter)))
         return True
     return False
 
 
 def _float_parameter(obj, parameter):
     if request.args.get(parameter) is not None:
-        obj.__dict__[parameter] = float(request.args.get(parameter))
+        setattr(obj, parameter, float(request.args.get(parameter)))
         return True
     return False
 
@@ -375,11 +945,26 @@ def _bool_parameter(obj, parameter):
         bval = False
         if val == "1" or val.capitalize() == "TRUE":
             bval = True
-        obj.__dict__[parameter] = bval
+        setattr(obj, parameter, bval)
         return True
     return False
 
 
+def _reset_journal(pod):
+    pod_id = _requested_pod_id()
+    if pod_id is not None:
+        pdm = get_manager().get_pdm(pod_id)
+    else:
+        pdm = g_pdm
+    if pdm is not None and pdm.pod is pod and pdm.journal is not None:
+        pdm.nonce = None
+        pdm.journal.set_nonce(None, 0)
+        pdm.journal.set_pod_id(pod.id_lot, pod.id_t)
+        pdm.journal.reset()
+    elif pod.path is not None:
+        SequenceJournal(get_journal_path(pod.path)).reset()
+
+
 def set_pod_parameters():
     _verify_auth(request)
 
@@ -395,9 +980,14 @@ def set_pod_parameters():
             pod.nonce_last = None
             pod.nonce_seed = 0
 
+        reset_sequences = False
         if _int_parameter(pod, "radio_address"):
             pod.radio_packet_sequence = 0
             pod.radio_message_sequence = 0
+            reset_sequences = True
+
+        if reset_nonce or reset_sequences:
+            _reset_journal(pod)
 
         _float_parameter(pod, "var_utc_offset")
         _float_parameter(pod, "var_maximum_bolus")
@@ -415,12 +1005,29 @@ def set_pod_parameters():
         pod.Save()
 
 
+def get_pods():
+    _verify_auth(request)
+    return {"pods": get_manager().get_summary()}
+
+
 def get_rl_info():
     _verify_auth(request)
-    r = RileyLink()
+    pod_id = _requested_pod_id()
+    if pod_id is not None:
+        r = RileyLink(get_manager().get_rileylink_address(pod_id))
+    else:
+        r = RileyLink(_get_default_rileylink().address)
     return r.get_info()
 
 
+def _is_status_not_modified(pdm, req_type, max_age):
+    age = pdm.get_status_age(req_type)
+    if age is None or age > max_age:
+        return False
+    etag = _pod_etag(pdm.pod)
+    return etag is not None and _matching_etag(etag) is not None
+
+
 def get_status():
     _verify_auth(request)
     t = request.args.get('type')
@@ -429,8 +1036,15 @@ def get_status():
     else:
         req_type = 0
 
+    max_age = request.args.get('max_age')
+    if max_age is not None:
+        max_age = float(max_age)
+
     pdm = _get_pdm()
-    id = pdm.update_status(req_type)
+    if max_age is not None and _is_status_not_modified(pdm, req_type, max_age):
+        return NOT_MODIFIED
+
+    id = pdm.update_status(req_type, max_age=max_age)
 
     return {"row_id":id}
 
@@ -439,7 +1053,10 @@ def deactivate_pod():
     _verify_auth(request)
     pdm = _get_pdm()
     id = pdm.deactivate_pod()
-    _archive_pod()
+    if _requested_pod_id() is not None:
+        get_manager().archive_pod(_requested_pod_id())
+    else:
+        _archive_pod()
     return {"row_id":id}
 
 
@@ -495,6 +1112,12 @@ def set_basal_schedule():
     return {"row_id":id}
 
 
+def get_radio_stats():
+    _verify_auth(request)
+    pdm = _get_pdm()
+    return pdm.get_radio_stats()
+
+
 def is_pdm_busy():
     pdm = _get_pdm()
     return {"busy": pdm.is_busy()}
@@ -516,15 +1139,110 @@ def silence_alarms():
     id = pdm.hf_silence_will_fall()
     return {"row_id":id}
 
+def _batch_step(step):
+    operation = step.get("op")
+    if operation == "status":
+        max_age = step.get("max_age")
+        if max_age is not None:
+            max_age = float(max_age)
+        return operation, {"update_type": int(step.get("type", 0)), "max_age": max_age}
+    if operation == "ack":
+        return operation, {"alert_mask": Decimal(step.get("alertmask"))}
+    if operation == "bolus":
+        return operation, {"bolus_amount": Decimal(step.get("amount"))}
+    if operation == "settempbasal":
+        return operation, {"basalRate": Decimal(step.get("amount")), "hours": Decimal(step.get("hours"))}
+    if operation == "setbasalschedule":
+        return operation, {"schedule": [Decimal(rate) for rate in step.get("schedule")]}
+    if operation in ["silence", "cancelbolus", "canceltempbasal"]:
+        return operation, {}
+    raise RestApiException("Unknown batch operation: %s" % operation)
+
+
+def execute_batch():
+    _verify_auth(request)
+
+    ops = request.args.get("ops")
+    if ops is None:
+        raise RestApiException("No batch operations defined")
+    steps = [_batch_step(step) for step in json.loads(ops, parse_float=Decimal)]
+
+    pdm = _get_pdm()
+    utc = request.args.get("utc")
+    if utc is not None:
+        pdm.pod.var_utc_offset = int(utc)
+
+    return {"steps": pdm.execute_batch(steps)}
+
+
+def _event_cursor():
+    since = request.args.get("since")
+    epoch = request.args.get("epoch")
+    if since is None and request.headers.get("Last-Event-ID"):
+        epoch, _, since = request.headers.get("Last-Event-ID").rpartition("-")
+    try:
+        if since is not None:
+            since = int(since)
+        if epoch:
+            epoch = int(epoch)
+        else:
+            epoch = None
+    except ValueError:
+        raise RestApiException("Invalid event cursor")
+    return get_event_stream().get_cursor(since, epoch)
+
+
+def _event_as_dict(event):
+    return {"id": event.version, "type": event.event_type, "time": event.timestamp, "pod": event.pod_id,
+            "data": event.data}
+
+
+def poll_events():
+    _verify_auth(request)
+    since = _event_cursor()
+    timeout = min(float(request.args.get("timeout", EVENT_POLL_TIMEOUT)), EVENT_POLL_TIMEOUT)
+    stream = get_event_stream()
+    events = stream.wait_events(since, timeout, _requested_pod_id())
+    return {"epoch": stream.epoch, "events": [_event_as_dict(e) for e in events]}
+
+
+def _stream_events(since, pod_id):
+    stream = get_event_stream()
+    yield "retry: %d\n\n" % (EVENT_STREAM_KEEPALIVE * 1000)
+    while not g_deny:
+        events = stream.wait_events(since, EVENT_STREAM_KEEPALIVE, pod_id)
+        if len(events) == 0:
+            yield ": keepalive\n\n"
+            continue
+        for event in events:
+            data = {"pod": event.pod_id, "data": event.data}
+            yield "id: %d-%d\nevent: %s\ndata: %s\n\n" % (stream.epoch, event.version, event.event_type,
+                                                            json.dumps(data, separators=(",", ":")))
+        since = events[-1].version
+
+
+def stream_events():
+    try:
+        _verify_stream_auth(request)
+        since = _event_cursor()
+        if g_server is not None and not g_server.acquire_stream():
+            raise RestApiException("Too many open event streams")
+    except Exception as e:
+        return _create_response(False, response=e, pod_status=_get_pod())
+    response = Response(stream_with_context(_stream_events(since, _requested_pod_id())), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache"})
+    if g_server is not None:
+        response.call_on_close(g_server.release_stream)
+    return response
+
+
 def shutdown():
     global g_deny
     _verify_auth(request)
 
     g_deny = True
 
-    pdm = _get_pdm()
-    while pdm.is_busy():
-        time.sleep(1)
+    _wait_until_idle(1)
     os.system("sudo shutdown -h")
     return {"shutdown": time.time()}
 
@@ -535,9 +1253,7 @@ def restart():
 
     g_deny = True
 
-    pdm = _get_pdm()
-    while pdm.is_busy():
-        time.sleep(1)
+    _wait_until_idle(1)
     os.system("sudo shutdown -r")
     return {"restart": time.time()}
 
@@ -547,9 +1263,7 @@ def update_omnipy():
     _verify_auth(request)
 
     g_deny = True
-    pdm = _get_pdm()
-    while pdm.is_busy():
-        time.sleep(1)
+    _wait_until_idle(1)
     os.system("/bin/bash /home/pi/omnipy/scripts/pi-update.sh")
     return {"update started": time.time()}
 
@@ -562,9 +1276,7 @@ def update_wlan():
     pw = str(request.args.get('pw'))
 
     g_deny = True
-    pdm = _get_pdm()
-    while pdm.is_busy():
-        time.sleep(1)
+    _wait_until_idle(1)
     os.system('/bin/bash /home/pi/omnipy/scripts/pi-setwifi.sh "%s" "%s"' % (ssid, pw))
     return {"update started": time.time()}
 
@@ -584,6 +1296,9 @@ def update_password():
         key_file.write(new_key)
     g_key = new_key
 
+    with g_token_lock:
+        g_sessions.clear()
+
 
 @app.route("/")
 def main_page():
@@ -607,6 +1322,18 @@ def a00():
 def a01():
     return _api_result(lambda: create_token(), "Failure while creating token")
 
+@app.route(REST_URL_SESSION)
+def a015():
+    return _api_result(lambda: create_session(), "Failure while creating session")
+
+@app.route(REST_URL_METRICS)
+def a017():
+    return get_metrics_text()
+
+@app.route(REST_URL_CLOCK)
+def a016():
+    return _api_result(lambda: get_clock_info(), "Failure while getting clock info")
+
 @app.route(REST_URL_CHECK_PASSWORD)
 def a02():
     return _api_result(lambda: check_password(), "Failure while verifying password")
@@ -629,7 +1356,7 @@ def a06():
 
 @app.route(REST_URL_STATUS)
 def a07():
-    return _api_result(lambda: get_status(), "Failure while executing getting pod status")
+    return _api_result(lambda: get_status(), "Failure while executing getting pod status", conditional=True)
 
 @app.route(REST_URL_ACK_ALERTS)
 def a08():
@@ -659,6 +1386,10 @@ def a13():
 def a14():
     return _api_result(lambda: is_pdm_busy(), "Failure while verifying if pdm is busy")
 
+@app.route(REST_URL_RADIO_STATS)
+def a141():
+    return _api_result(lambda: get_radio_stats(), "Failure while getting radio statistics")
+
 @app.route(REST_URL_OMNIPY_SHUTDOWN)
 def a15():
     return _api_result(lambda: shutdown(), "Failure while executing shutdown")
@@ -703,22 +1434,43 @@ def a23():
 def a24():
     return _api_result(lambda: silence_alarms(), "Failure while silencing")
 
-def _run_flask():
+@app.route(REST_URL_EVENTS)
+def a25():
+    if request.args.get("poll") is not None:
+        return _api_result(lambda: poll_events(), "Failure while polling pod events", state_delta=False)
+    return stream_events()
+
+@app.route(REST_URL_BATCH)
+def a26():
+    return _api_result(lambda: execute_batch(), "Failure while executing batch")
+
+@app.route(REST_URL_PODS)
+def a27():
+    return _api_result(lambda: get_pods(), "Failure while listing managed pods")
+
+def _run_flask(debug=False):
+    global g_server
     try:
-        app.run(host='0.0.0.0', port=4444, debug=True, use_reloader=False)
+        if debug:
+            app.run(host=REST_API_HOST, port=REST_API_PORT, debug=True, use_reloader=False)
+        else:
+            g_server = PooledWSGIServer(REST_API_HOST, REST_API_PORT, app)
+            g_server.serve_forever()
     except:
         logger.exception("Error while running rest api, exiting")
 
 
-def _exit_with_grace():
+def _exit_with_grace(*args):
     try:
         global g_deny
         g_deny = True
-        pdm = _get_pdm()
-        while pdm.is_busy():
-            time.sleep(5)
+        get_event_stream().publish("shutdown", None)
+        _wait_until_idle(5)
+        if g_server is not None:
+            g_server.drain()
         _flush_handlers(getLogger())
         _flush_handlers(get_packet_logger())
+        close_packet_captures()
     except:
         logger.exception("error during graceful shutdown")
 
@@ -726,6 +1478,10 @@ def _exit_with_grace():
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Omnipy rest api")
+    parser.add_argument("--debug", action="store_true", help="Run on the flask development server in debug mode")
+    args = parser.parse_args()
+
     logger.info("Rest api is starting")
 
     try:
@@ -740,15 +1496,22 @@ if __name__ == '__main__':
     except:
         logger.exception("Error while reloading timesync daemon")
 
+    try:
+        get_manager().load()
+    except:
+        logger.exception("Error while loading managed pods")
+
     signal.signal(signal.SIGTERM, _exit_with_grace)
 
-    t = Thread(target=_run_flask)
+    t = Thread(target=_run_flask, args=(args.debug,))
     t.setDaemon(True)
     t.start()
 
     try:
         while True:
-            time.sleep(1)
+            time.sleep(CLOCK_SYNC_INTERVAL)
+            for pdm in _get_all_pdms():
+                g_clock.apply(pdm)
 
     except KeyboardInterrupt:
         _exit_with_grace()
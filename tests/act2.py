@@ -18,7 +18,6 @@ except:
 if pod is None:
     pod = Pod()
     pod.path = "/home/ba/newpod2.json"
-    pod.log_file_path = "/home/ba/newpod2.json.log"
 
 
 req_address = 0x1f000015
@@ -0,0 +1,98 @@
+from podcomm.definitions import *
+from podcomm.pdm import Pdm
+from podcomm.pod import Pod
+from threading import Thread
+import http.client
+import restapi
+import socket
+import time
+
+LINK_BYTES_PER_SECOND = 32 * 1024
+LINK_DELAY = 0.02
+ROUNDS = 50
+PROXY_PORT = 14446
+SERVER_PORT = 14447
+
+VARIANTS = [
+    ("json", {}),
+    ("json gzip", {"Accept-Encoding": "gzip"}),
+    ("json deflate", {"Accept-Encoding": "deflate"}),
+    ("msgpack", {"Accept": restapi.MSGPACK_MIMETYPE}),
+    ("msgpack gzip", {"Accept": restapi.MSGPACK_MIMETYPE, "Accept-Encoding": "gzip"}),
+]
+
+pod = Pod()
+pod.id_lot = 44425
+pod.id_t = 381741
+pod.radio_address = 0x1f10fc49
+pod.state_progress = PodProgress.Running
+pod.state_last_updated = time.time()
+pod.var_basal_schedule = [0.85] * 48
+pod.last_command = {"command": "STATUS", "type": 0, "success": True}
+restapi.g_pod = pod
+restapi.g_pdm = Pdm(pod)
+restapi._verify_auth = lambda request_obj: None
+
+
+def _throttle(source, target):
+    try:
+        while True:
+            data = source.recv(4096)
+            if not data:
+                break
+            time.sleep(LINK_DELAY + len(data) / LINK_BYTES_PER_SECOND)
+            target.sendall(data)
+    except OSError:
+        pass
+    finally:
+        target.close()
+
+
+def _proxy():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", PROXY_PORT))
+    listener.listen(4)
+    while True:
+        client, _ = listener.accept()
+        server = socket.create_connection(("127.0.0.1", SERVER_PORT))
+        for source, target in [(client, server), (server, client)]:
+            t = Thread(target=_throttle, args=(source, target))
+            t.setDaemon(True)
+            t.start()
+
+
+def _run(name, headers):
+    if name.startswith("msgpack") and restapi.msgpack is None:
+        print("%-14s skipped, msgpack is not installed" % name)
+        return
+
+    conn = http.client.HTTPConnection("127.0.0.1", PROXY_PORT)
+    latencies = []
+    size = 0
+    for i in range(ROUNDS):
+        start = time.perf_counter()
+        conn.request("GET", REST_URL_STATUS + "?max_age=3600", headers=headers)
+        size = len(conn.getresponse().read())
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+    latencies.sort()
+    print("%-14s %6d B  p50 %7.1f ms  p90 %7.1f ms" %
+          (name, size, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.9)] * 1000))
+
+
+server = restapi.PooledWSGIServer("127.0.0.1", SERVER_PORT, restapi.app)
+t = Thread(target=server.serve_forever)
+t.setDaemon(True)
+t.start()
+
+t = Thread(target=_proxy)
+t.setDaemon(True)
+t.start()
+
+print("link: %d B/s, %d ms delay per segment" % (LINK_BYTES_PER_SECOND, LINK_DELAY * 1000))
+for name, headers in VARIANTS:
+    _run(name, headers)
+
+server.drain(5)
@@ -0,0 +1,29 @@
+from podcomm.metrics import Metrics
+import timeit
+
+ROUNDS = 200000
+
+metrics = Metrics()
+histogram = metrics.histogram("bench_seconds", "Benchmark histogram", result="success")
+counter = metrics.counter("bench_total", "Benchmark counter")
+
+
+def _noop(value):
+    pass
+
+
+print("%-34s %8.0f ns" % ("baseline call",
+                          timeit.timeit(lambda: _noop(0.042), number=ROUNDS) * 1e9 / ROUNDS))
+print("%-34s %8.0f ns" % ("counter inc",
+                          timeit.timeit(lambda: counter.inc(), number=ROUNDS) * 1e9 / ROUNDS))
+print("%-34s %8.0f ns" % ("histogram observe",
+                          timeit.timeit(lambda: histogram.observe(0.042), number=ROUNDS) * 1e9 / ROUNDS))
+print("%-34s %8.0f ns" % ("labelled lookup and observe",
+                          timeit.timeit(lambda: metrics.histogram("bench_seconds", "Benchmark histogram",
+                                                                  result="success").observe(0.042),
+                                        number=ROUNDS) * 1e9 / ROUNDS))
+
+for i in range(50):
+    metrics.histogram("bench_handler_seconds", "Benchmark handlers", handler="/h%d" % i).observe(0.01 * i)
+print("%-34s %8.0f us" % ("render 52 series",
+                          timeit.timeit(lambda: metrics.render(), number=200) * 1e6 / 200))
@@ -0,0 +1,34 @@
+from podcomm.pod import Pod
+from podcomm.definitions import *
+import simplejson as json
+import tempfile
+import timeit
+import time
+
+ROUNDS = 2000
+
+pod = Pod()
+pod.id_lot = 44425
+pod.id_t = 381741
+pod.radio_address = 0x1f10fc49
+pod.state_progress = PodProgress.Running
+pod.state_last_updated = time.time()
+pod.var_basal_schedule = [0.85] * 48
+pod.last_command = {"command": "STATUS", "type": 0, "success": True}
+
+with tempfile.TemporaryDirectory() as tmp:
+    pod.path = tmp + "/pod.json"
+    pod.path_db = tmp + "/pod.db"
+    with open(pod.path, "w") as stream:
+        json.dump(pod.as_dict(), stream, indent=4, sort_keys=True)
+
+    t_load = timeit.timeit(lambda: Pod.Load(pod.path, pod.path_db), number=ROUNDS)
+
+t_dict = timeit.timeit(lambda: pod.as_dict(), number=ROUNDS)
+t_pretty = timeit.timeit(lambda: json.dumps(pod.as_dict(), indent=4, sort_keys=True), number=ROUNDS)
+t_compact = timeit.timeit(lambda: json.dumps(pod.as_dict(), separators=(",", ":")), number=ROUNDS)
+
+print("Pod.Load          %8.2f us" % (t_load * 1e6 / ROUNDS))
+print("as_dict           %8.2f us" % (t_dict * 1e6 / ROUNDS))
+print("status (pretty)   %8.2f us" % (t_pretty * 1e6 / ROUNDS))
+print("status (compact)  %8.2f us" % (t_compact * 1e6 / ROUNDS))
@@ -0,0 +1,55 @@
+from podcomm.definitions import *
+from podcomm.pod import Pod
+import simplejson as json
+import restapi
+import timeit
+import time
+
+ROUNDS = 2000
+
+pod = Pod()
+pod.id_lot = 44425
+pod.id_t = 381741
+pod.radio_address = 0x1f10fc49
+pod.state_progress = PodProgress.Running
+pod.state_last_updated = time.time()
+pod.var_basal_schedule = [0.85] * 48
+pod.last_command = {"command": "STATUS", "type": 0, "success": True}
+
+ENDPOINTS = [
+    (REST_URL_PING, {"pong": None}),
+    (REST_URL_TOKEN, {"token": "ZGVhZGJlZWZkZWFkYmVlZmRlYWRiZWVmZGVhZGJlZWY="}),
+    (REST_URL_STATUS, {"row_id": 1234}),
+    (REST_URL_BOLUS, restapi.RestApiException("Pdm is busy.")),
+]
+
+
+def _legacy(response):
+    if response.__class__ != dict:
+        response = response.__dict__
+    return json.dumps({"success": True,
+                       "response": response,
+                       "status": pod.as_dict(),
+                       "datetime": time.time(),
+                       "api": {"version_major": API_VERSION_MAJOR, "version_minor": API_VERSION_MINOR,
+                               "version_revision": API_VERSION_REVISION, "version_build": API_VERSION_BUILD}
+                       }, indent=4, sort_keys=True)
+
+
+encoder = restapi.ResponseEncoder()
+
+print("%-22s %10s %10s %10s %10s" % ("endpoint", "legacy B", "compact B", "legacy us", "compact us"))
+for url, response in ENDPOINTS:
+    legacy = _legacy(response)
+    compact = encoder.encode(True, response, pod)
+    assert json.loads(compact)["status"] == json.loads(legacy)["status"]
+
+    t_legacy = timeit.timeit(lambda: _legacy(response), number=ROUNDS)
+    t_compact = timeit.timeit(lambda: encoder.encode(True, response, pod), number=ROUNDS)
+    print("%-22s %10d %10d %10.1f %10.1f" % (url, len(legacy), len(compact),
+                                            t_legacy * 1e6 / ROUNDS, t_compact * 1e6 / ROUNDS))
+
+pod.state_active_minutes += 5
+pod.last_command = {"command": "BOLUS", "units": 1.5, "success": True}
+t_changed = timeit.timeit(lambda: encoder.encode(True, {"row_id": 1235}, pod), number=1)
+print("first response after a pod update: %.1f us" % (t_changed * 1e6))
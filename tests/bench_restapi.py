@@ -0,0 +1,64 @@
+from podcomm.definitions import *
+from podcomm.pdm import Pdm
+from podcomm.pod import Pod
+from podcomm.protocol_radio import PdmRadio
+from tests.mock_radio import MockPacketRadio
+from werkzeug.serving import make_server
+from threading import Thread
+import http.client
+import restapi
+import time
+
+CLIENTS = 8
+REQUESTS_PER_CLIENT = 200
+PATHS = [REST_URL_PING, REST_URL_PDM_BUSY]
+
+pod = Pod()
+pod.radio_address = 0x1f10fc49
+pdm = Pdm(pod)
+pdm.radio = PdmRadio(pod.radio_address, packet_radio=MockPacketRadio())
+restapi.g_pod = pod
+restapi.g_pdm = pdm
+
+
+def _client(port, latencies):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    for i in range(REQUESTS_PER_CLIENT):
+        start = time.perf_counter()
+        conn.request("GET", PATHS[i % len(PATHS)])
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _run(name, server, port):
+    t = Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+
+    latencies = []
+    clients = [Thread(target=_client, args=(port, latencies)) for _ in range(CLIENTS)]
+    start = time.perf_counter()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    server.server_close()
+
+    latencies.sort()
+    print("%-12s %6d req %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms" %
+          (name, len(latencies), len(latencies) / elapsed,
+           _percentile(latencies, 0.50) * 1000, _percentile(latencies, 0.99) * 1000))
+
+
+_run("development", make_server("127.0.0.1", 14444, restapi.app, threaded=True), 14444)
+_run("pooled", restapi.PooledWSGIServer("127.0.0.1", 14445, restapi.app), 14445)
+
+pdm.stop_radio()
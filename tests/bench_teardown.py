@@ -0,0 +1,100 @@
+from podcomm.protocol_radio import PdmRadio, RadioPacket, RadioPacketType
+from podcomm.crc import crc16
+from podcomm.packet_radio import PacketRadio
+from podcomm.teardown import TeardownEstimator
+from podcomm.protocol import request_status
+from podcomm.definitions import *
+import random
+import struct
+import time
+
+ADDRESS = 0x1f0e89f0
+COMMANDS = 24
+AIR_TIME = 0.03
+MISS_RATES = [0.0, 0.2]
+STATUS = bytes([0x1d, 0x08, 0, 0, 0, 0, 0, 0, 0, 0])
+
+
+class FixedTeardown(TeardownEstimator):
+    def get_preempt_after(self):
+        return RADIO_TEARDOWN_MAX_PREEMPT
+
+    def get_silence_timeout(self):
+        return RADIO_TEARDOWN_MAX_SILENCE
+
+
+class SimulatedPod(PacketRadio):
+    def __init__(self, miss_rate, rng):
+        self.miss_rate = miss_rate
+        self.rng = rng
+        self.last_packet = None
+
+    def connect(self, force_initialize=False):
+        pass
+
+    def disconnect(self, ignore_errors=True):
+        pass
+
+    def get_info(self):
+        return None
+
+    def init_radio(self, force_init=False):
+        pass
+
+    def tx_up(self):
+        pass
+
+    def tx_down(self):
+        pass
+
+    def set_tx_power(self, tx_power):
+        pass
+
+    def get_packet(self, timeout=5.0):
+        time.sleep(timeout)
+        return None
+
+    def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
+        time.sleep(AIR_TIME)
+
+    def send_and_receive_packet(self, packet, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
+        p = RadioPacket.parse(packet)
+        if p.type == RadioPacketType.PDM:
+            message_sequence = (((p.body[4] >> 2) & 0x0f) + 1) % 16
+            body = struct.pack(">I", ADDRESS) + bytes([message_sequence << 2, len(STATUS)]) + STATUS
+            body += struct.pack(">H", crc16(body))
+            self.last_packet = RadioPacket(ADDRESS, RadioPacketType.POD, (p.sequence + 1) % 32, body)
+            time.sleep(AIR_TIME)
+            return bytes([0xff, 0xff]) + self.last_packet.get_data()
+
+        if self.last_packet is not None and self.rng.random() < self.miss_rate:
+            time.sleep(AIR_TIME)
+            return bytes([0xff, 0xff]) + self.last_packet.get_data()
+
+        self.last_packet = None
+        time.sleep(timeout_ms / 1000)
+        return None
+
+
+def _run(name, teardown, miss_rate):
+    radio = PdmRadio(ADDRESS, packet_radio=SimulatedPod(miss_rate, random.Random(7)))
+    radio.teardown = teardown
+    intervals = []
+    last = None
+    for i in range(COMMANDS):
+        radio.send_message_get_message(request_status())
+        now = time.time()
+        if last is not None:
+            intervals.append(now - last)
+        last = now
+    radio.stop()
+
+    warm = intervals[RADIO_TEARDOWN_MIN_SAMPLES:]
+    print("%-8s miss %.1f  command-to-command mean %.3fs  after warm-up %.3fs  preempt %.2fs  silence %.2fs" %
+          (name, miss_rate, sum(intervals) / len(intervals), sum(warm) / len(warm),
+           teardown.get_preempt_after(), teardown.get_silence_timeout()))
+
+
+for miss_rate in MISS_RATES:
+    _run("fixed", FixedTeardown(), miss_rate)
+    _run("learned", TeardownEstimator(), miss_rate)
@@ -15,7 +15,6 @@ def skip_ack(packet):
         return packet
 
 path = "data/bbe.json"
-log_path = "data/bbe.log"
 pod = None
 try:
     pod = Pod.Load(path)
@@ -25,7 +24,6 @@ except:
 if pod is None:
     pod = Pod()
     pod.path = path
-    pod.log_file_path = log_path
     pod.id_lot = 44147
     pod.id_t = 1100256
     pod.radio_address = 0x1f0e89f0
@@ -18,7 +18,7 @@ pod.id_lot = 44425
 msg = request_status()
 msg = radio.send_message_get_message(msg)
 response_parse(msg, pod)
-print(pod.__dict__)
+print(pod)
 
 
 
@@ -4,7 +4,6 @@ from podcomm.pod import Pod
 
 def get_pod():
     path = "data/bbe.json"
-    log_path = "data/bbe.log"
     pod = None
 
     try:
@@ -15,7 +14,6 @@ def get_pod():
     if pod is None:
         pod = Pod()
         pod.path = path
-        pod.log_file_path = log_path
         pod.id_lot = 44147
         pod.id_t = 1100256
         pod.radio_address = 0x1f0e89f0
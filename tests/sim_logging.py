@@ -0,0 +1,28 @@
+from podcomm.definitions import *
+from podcomm.protocol_common import RadioPacket, RadioPacketType
+
+packet_logger = get_packet_logger()
+logger = getLogger()
+
+packet = RadioPacket(0x1f000015, RadioPacketType.PDM, 3, bytes([0x1f, 0x00, 0x00, 0x15, 0x0c, 0x03]))
+packet_logger.info("SEND PKT %s", packet)
+expected = str(packet)
+packet.with_sequence(17)
+
+try:
+    raise ValueError("probe failure")
+except ValueError:
+    logger.exception("Logged while handling %s", "probe")
+
+flush_logger(packet_logger)
+flush_logger(logger)
+
+with open(DATA_PATH + OMNIPY_PACKET_LOGFILE + LOGFILE_SUFFIX, "r") as stream:
+    lines = [line for line in stream.read().splitlines() if "SEND PKT" in line]
+assert lines[-1].endswith("SEND PKT " + expected), lines[-1]
+print("packet logged as it was when sent: %s" % lines[-1])
+
+with open(DATA_PATH + OMNIPY_LOGFILE + LOGFILE_SUFFIX, "r") as stream:
+    text = stream.read()
+assert "Logged while handling probe" in text and "ValueError: probe failure" in text
+print("exception logged with its traceback")
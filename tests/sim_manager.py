@@ -0,0 +1,66 @@
+from podcomm.manager import PdmManager
+from podcomm.events import get_event_stream
+from podcomm.capture import get_packet_capture
+from podcomm.exceptions import PdmError
+from podcomm.protocol_common import PodResponse
+from podcomm.definitions import *
+import simplejson as json
+
+
+class StatusResponse:
+    def get_parts(self):
+        return [(PodResponse.Status, bytes(9))]
+
+
+def expect_error(action, message):
+    try:
+        action()
+        assert False, message
+    except PdmError as e:
+        print("rejected: %s" % e)
+
+
+ensure_log_dir()
+config_path = DATA_PATH + PODS_CONFIG_FILE
+with open(config_path, "w") as stream:
+    json.dump({"pods": [{"id": "left", "rileylink": "aa:aa:aa:aa:aa:01"},
+                        {"id": "right", "rileylink": ["aa:aa:aa:aa:aa:02", "aa:aa:aa:aa:aa:03"]}]}, stream)
+
+manager = PdmManager()
+manager.load(config_path)
+assert sorted(manager.get_pod_ids()) == ["left", "right"]
+assert manager.get_rileylink_address("right") == "aa:aa:aa:aa:aa:02"
+print("loaded %s" % manager.get_summary())
+
+expect_error(lambda: manager.add_pod("left", "aa:aa:aa:aa:aa:09"), "duplicate pod id")
+expect_error(lambda: manager.add_pod("other", "aa:aa:aa:aa:aa:03"), "RileyLink assigned twice")
+expect_error(lambda: manager.add_pod("../pod", "aa:aa:aa:aa:aa:09"), "path in pod id")
+expect_error(lambda: manager.get_pdm("missing"), "unknown pod")
+
+left = manager.get_pdm("left")
+right = manager.get_pdm("right")
+assert left.pod.path != right.pod.path and left.lock is not right.lock
+assert get_packet_capture("left").path != get_packet_capture("right").path
+
+stream = get_event_stream()
+since = stream.version
+left._parse_response(StatusResponse())
+right._parse_response(StatusResponse())
+right._parse_response(StatusResponse())
+assert [e.pod_id for e in stream.get_events(since)] == ["left", "right", "right"]
+assert len(stream.get_events(since, "left")) == 1
+assert len(stream.wait_events(since, 0.1, "right")) == 2
+print("status events are tagged and filtered by pod")
+
+right.pod.id_lot = 1234
+right.pod.Save()
+archive = manager.archive_pod("right")
+assert os.path.isfile(archive)
+assert manager.get_pdm("right").pod.id_lot is None
+assert manager.get_pdm("right").packet_radio is right.packet_radio
+print("archived right pod to %s" % archive)
+
+manager.remove_pod("left")
+manager.add_pod("left2", "aa:aa:aa:aa:aa:01")
+print("RileyLink of a removed pod can be reassigned")
+manager.stop()
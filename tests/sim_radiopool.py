@@ -0,0 +1,92 @@
+from podcomm.packet_radio import PacketRadio, TxPower
+from podcomm.radiopool import RadioPool
+from podcomm.exceptions import PacketRadioError
+import time
+
+STANDBY_CONNECT_TIME = 0.5
+
+
+class SimulatedRadio(PacketRadio):
+    def __init__(self, address, connect_time=0.0):
+        self.address = address
+        self.connect_time = connect_time
+        self.connected = False
+        self.failing = False
+        self.sends = 0
+        self.tx_power = None
+
+    def connect(self, force_initialize=False):
+        time.sleep(self.connect_time)
+        self.connected = True
+
+    def disconnect(self, ignore_errors=True):
+        self.connected = False
+
+    def get_info(self):
+        return {"address": self.address}
+
+    def init_radio(self, force_init=False):
+        pass
+
+    def tx_up(self):
+        pass
+
+    def tx_down(self):
+        pass
+
+    def set_tx_power(self, tx_power):
+        self.tx_power = tx_power
+
+    def get_packet(self, timeout=5.0):
+        return None
+
+    def send_and_receive_packet(self, packet, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
+        self.sends += 1
+        if self.failing or not self.connected:
+            raise PacketRadioError("%s failed" % self.address)
+        return self.address
+
+    def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
+        return self.send_and_receive_packet(packet, repeat_count, delay_ms, 0, 0, preamble_extension_ms)
+
+
+def send(pool):
+    try:
+        return pool.send_and_receive_packet(b"", 0, 0, 300, 0, 40)
+    except PacketRadioError as e:
+        return str(e)
+
+
+primary = SimulatedRadio("primary")
+standby = SimulatedRadio("standby", connect_time=STANDBY_CONNECT_TIME)
+pool = RadioPool([primary, standby])
+
+start = time.time()
+pool.connect()
+elapsed = time.time() - start
+assert elapsed < STANDBY_CONNECT_TIME and not standby.connected
+print("connect returned after %.2fs, standby still connecting" % elapsed)
+pool.standby_thread.join()
+assert standby.connected
+print("standby connected in the background")
+
+pool.set_tx_power(TxPower.High)
+assert send(pool) == "primary"
+
+primary.failing = True
+print("first error:", send(pool))
+assert primary.sends == 2 and pool.active.radio is primary
+print("second error:", send(pool))
+assert primary.sends == 3 and pool.active.radio is standby
+assert standby.tx_power == TxPower.High
+print("each error surfaced once, then failed over to %s" % send(pool))
+print(pool.get_summary())
+
+primary.failing = False
+primary.connect_time = STANDBY_CONNECT_TIME
+pool.members[0].connect_attempted = None
+pool.connect()
+pool.disconnect_all()
+pool.standby_thread.join()
+assert not primary.connected and not standby.connected
+print("standby connecting during disconnect_all was disconnected")
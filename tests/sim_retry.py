@@ -0,0 +1,117 @@
+from podcomm.retry import DefaultRetryPolicy, AdaptiveRetryPolicy
+from podcomm.protocol_radio import MessageExchange
+import random
+
+MESSAGES = 2000
+SEND_TIME = 0.3
+RADIO_ERROR_TIME = 1.0
+REINIT_TIME = 3.0
+RESTART_TIME = 5.0
+P_RADIO_SILENT = 0.03
+P_RADIO_ERROR = 0.02
+LOSS_RATES = [0.0, 0.2, 0.4, 0.6, 0.75]
+
+
+class SimulatedTimeout(Exception):
+    pass
+
+
+class SimulatedRadioError(Exception):
+    pass
+
+
+class SimulatedLink:
+    def __init__(self, loss, rng):
+        self.loss = loss
+        self.rng = rng
+        self.silent = False
+        self.failing = False
+        self.time = 0.0
+
+    def new_message(self):
+        self.silent = self.rng.random() < P_RADIO_SILENT
+        self.failing = self.rng.random() < P_RADIO_ERROR
+
+    def exchange_packets(self, timeout, exchange):
+        start = self.time
+        first = True
+        while self.time - start < timeout:
+            if not first:
+                exchange.repeated_sends += 1
+            first = False
+            if self.failing:
+                self.time += RADIO_ERROR_TIME
+                raise SimulatedRadioError()
+            self.time += SEND_TIME
+            if self.silent or self.rng.random() >= (1 - self.loss) ** 2:
+                exchange.receive_timeouts += 1
+                continue
+            return
+        raise SimulatedTimeout()
+
+    def recover(self, action):
+        if action.reinit_radio:
+            self.time += REINIT_TIME
+            if self.rng.random() < 0.9:
+                self.silent = False
+            if self.rng.random() < 0.5:
+                self.failing = False
+        if action.restart_radio:
+            self.time += RESTART_TIME
+            if self.rng.random() < 0.95:
+                self.silent = False
+                self.failing = False
+        self.time += action.delay
+
+
+def _send(policy, link):
+    exchange = MessageExchange()
+    exchange.unique_packets = 2
+    exchange.started = link.time
+    link.new_message()
+
+    timeout = policy.initial_timeout(0, 1)
+    repeat_count = -1
+    while True:
+        repeat_count += 1
+        try:
+            link.exchange_packets(timeout, exchange)
+            exchange.successful = True
+            break
+        except SimulatedTimeout:
+            action = policy.on_timeout(0, 1, repeat_count)
+        except SimulatedRadioError:
+            exchange.radio_errors += 1
+            action = policy.on_radio_error(0, 1, repeat_count)
+        if action.give_up:
+            break
+        link.recover(action)
+        if action.timeout is not None:
+            timeout = action.timeout
+
+    exchange.ended = link.time
+    policy.record(exchange)
+    return exchange
+
+
+def _run(name, policy, loss):
+    link = SimulatedLink(loss, random.Random(42))
+    durations = []
+    failures = 0
+    for i in range(MESSAGES):
+        exchange = _send(policy, link)
+        if exchange.successful:
+            durations.append(exchange.ended - exchange.started)
+        else:
+            failures += 1
+
+    durations.sort()
+    print("%-9s loss %.2f  success %6.2f%%  mean %6.2fs  p50 %6.2fs  p90 %6.2fs  p99 %6.2fs" %
+          (name, loss, 100.0 * len(durations) / MESSAGES, sum(durations) / len(durations),
+           durations[len(durations) // 2], durations[len(durations) * 9 // 10],
+           durations[len(durations) * 99 // 100]))
+
+
+for loss in LOSS_RATES:
+    _run("default", DefaultRetryPolicy(), loss)
+    _run("adaptive", AdaptiveRetryPolicy(), loss)